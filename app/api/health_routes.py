@@ -0,0 +1,71 @@
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse, PlainTextResponse
+from ..services.metrics import registry, Gauge
+from .photo_routes import processing_pool
+from .job_routes import job_queue
+
+router = APIRouter()
+startup_timings = {}
+
+def _pool_gauge(running: bool):
+    running_jobs = min(processing_pool.pending, processing_pool.workers)
+    return {(): running_jobs if running else processing_pool.pending - running_jobs}
+
+def _job_queue_gauge():
+    return {(status,): count for status, count in job_queue.counts().items()}
+
+def _model_load_gauge():
+    values = {("app", phase): ms / 1000 for phase, ms in startup_timings.items()}
+    for pid, timings in processing_pool.startup_timings.items():
+        values.update({(str(pid), phase): ms / 1000 for phase, ms in timings.items()})
+    return values
+
+def _process_memory_gauge():
+    # Pss splits shared pages between the processes mapping them: with pre-fork
+    # workers, summing it across processes gives the real footprint
+    values = {}
+    try:
+        with open("/proc/self/smaps_rollup") as f:
+            for line in f:
+                key, _, rest = line.partition(":")
+                if key in ("Rss", "Pss", "Shared_Clean", "Shared_Dirty", "Private_Clean", "Private_Dirty"):
+                    values[(key.lower(),)] = int(rest.split()[0]) * 1024
+    except OSError:
+        pass
+    return values
+
+registry.register(Gauge("simbaris_jobs_in_flight", "Pool jobs running on a worker.",
+                        collect=lambda: _pool_gauge(True)))
+registry.register(Gauge("simbaris_queue_depth", "Pool jobs waiting for a worker.",
+                        collect=lambda: _pool_gauge(False)))
+registry.register(Gauge("simbaris_pool_workers", "Processing pool workers.",
+                        collect=lambda: {(): processing_pool.workers}))
+registry.register(Gauge("simbaris_job_queue_jobs", "Submitted jobs by status.", ("status",),
+                        collect=_job_queue_gauge))
+registry.register(Gauge("simbaris_model_load_seconds", "Startup phase durations (app, or worker pid).",
+                        ("worker", "phase"), collect=_model_load_gauge))
+registry.register(Gauge("simbaris_process_memory_bytes", "Memory of this process from /proc/self/smaps_rollup.",
+                        ("kind",), collect=_process_memory_gauge))
+
+def _rounded(timings: dict) -> dict:
+    return {name: round(ms, 1) for name, ms in timings.items()}
+
+@router.get("/healthz")
+async def healthz():
+    """Liveness: the process is up and serving requests."""
+    return {"status": "ok"}
+
+@router.get("/readyz")
+async def readyz():
+    """Readiness: models are loaded and warmed up."""
+    body = {
+        "status": "ready" if processing_pool.started else "loading",
+        "startup_ms": _rounded(startup_timings),
+        "workers_ms": {pid: _rounded(t) for pid, t in processing_pool.startup_timings.items()},
+    }
+    return JSONResponse(content=body, status_code=200 if processing_pool.started else 503)
+
+@router.get("/metrics")
+async def metrics():
+    """Prometheus metrics in the text exposition format."""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
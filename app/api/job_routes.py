@@ -0,0 +1,81 @@
+from fastapi import APIRouter, UploadFile, File, Form, HTTPException
+from fastapi.responses import JSONResponse
+from typing import Optional
+import asyncio
+import json
+from ..services.contour_processing import ContourProcessingService
+from ..services.image_io import read_upload, release_upload, ImageTooLargeError
+from ..services.job_queue import JobQueue
+from ..services.job_runner import JobRunner
+from .photo_routes import processing_pool
+
+router = APIRouter()
+job_queue = JobQueue()
+job_runner = JobRunner(job_queue, processing_pool)
+
+def _status(job: dict) -> dict:
+    return {
+        "job_id": job["id"],
+        "status": job["status"],
+        "filename": job["filename"],
+        "progress": job["progress"],
+        "attempts": job["attempts"],
+        "error": job["error"],
+        "created_at": job["created_at"],
+        "started_at": job["started_at"],
+        "finished_at": job["finished_at"],
+    }
+
+async def _get_job(job_id: str) -> dict:
+    job = await asyncio.to_thread(job_queue.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job {job_id}")
+    return job
+
+@router.post("", status_code=202)
+async def submit_job(file: UploadFile = File(...), settings: Optional[str] = Form(None)):
+    """
+    Queue an image, PDF or TIFF for processing and return its job id at once.
+
+    ``settings`` is an optional JSON object of overrides, as for
+    ``/api/photos/reprocess``. The job and its input are stored on disk, so
+    it runs even if the client goes away or the server restarts.
+    """
+    try:
+        overrides = json.loads(settings) if settings else {}
+        if not isinstance(overrides, dict):
+            raise ValueError("settings must be a JSON object")
+        ContourProcessingService.effective_settings(overrides)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    upload = None
+    try:
+        upload = await read_upload(file)
+        job = await asyncio.to_thread(job_queue.submit, upload, file.filename, overrides)
+    except ImageTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        # submit moves a spooled upload; whatever is left is ours to delete
+        if upload is not None:
+            release_upload(upload)
+
+    job_runner.notify()
+    return JSONResponse(content=_status(job), status_code=202)
+
+@router.get("/{job_id}")
+async def job_status(job_id: str):
+    """Job state (queued, running, done, failed) and the stage it is in."""
+    return _status(await _get_job(job_id))
+
+@router.get("/{job_id}/result")
+async def job_result(job_id: str):
+    """The processing result of a finished job; 409 while it is still queued or running."""
+    job = await _get_job(job_id)
+    if job["status"] == "failed":
+        raise HTTPException(status_code=422, detail=job["error"])
+    if job["status"] != "done":
+        raise HTTPException(status_code=409, detail=f"Job is {job['status']}")
+    return JSONResponse(content=job["result"])
@@ -0,0 +1,71 @@
+from fastapi import APIRouter, UploadFile, File, Form, HTTPException
+from fastapi.responses import JSONResponse
+from typing import Optional
+import asyncio
+import json
+from ..services.image_io import read_upload, release_upload, ImageTooLargeError, InvalidImageError
+from ..services.layouts import LayoutRegistry
+from ..services.worker_pool import PoolBusyError, JobTimeoutError
+from .photo_routes import processing_pool
+
+router = APIRouter()
+# Same directory the workers match against; they reload when it changes
+layout_registry = LayoutRegistry()
+
+def _rects(value: Optional[str], keys: tuple, label: str) -> Optional[list]:
+    """Parse a JSON list of rectangles given as objects with ``keys``."""
+    if not value:
+        return None
+    try:
+        items = json.loads(value)
+        return [tuple(int(item[key]) for key in keys) for item in items]
+    except (ValueError, TypeError, KeyError) as e:
+        raise ValueError(f"{label} must be a JSON list of {{{', '.join(keys)}}} objects") from e
+
+@router.get("")
+async def list_layouts():
+    """Registered form layouts with their photo slots and name fields."""
+    layouts = await asyncio.to_thread(layout_registry.layouts)
+    return [layout.describe() for layout in layouts.values()]
+
+@router.post("", status_code=201)
+async def register_layout(
+    file: UploadFile = File(...),
+    name: str = Form(...),
+    slots: Optional[str] = Form(None),
+    name_fields: Optional[str] = Form(None),
+):
+    """
+    Register a form layout from a blank or filled copy of the form.
+
+    ``slots`` is an optional JSON list of photo slots (``{"x", "y", "w",
+    "h"}``) and ``name_fields`` one name field (``{"x0", "y0", "x1", "y1"}``)
+    per slot, in the uploaded image's pixels. Without them, the photo boxes
+    detected on the image and the name band under each are registered.
+    Pages matching the layout then skip contour search; registering an
+    existing name replaces it.
+    """
+    upload = None
+    try:
+        slot_rects = _rects(slots, ("x", "y", "w", "h"), "slots")
+        field_rects = _rects(name_fields, ("x0", "y0", "x1", "y1"), "name_fields")
+        upload = await read_upload(file)
+        layout = await processing_pool.run("register_layout", upload, name, slots=slot_rects, fields=field_rects)
+        return JSONResponse(content=layout, status_code=201)
+    except ImageTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except (InvalidImageError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except PoolBusyError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except JobTimeoutError as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    finally:
+        if upload is not None:
+            release_upload(upload)
+
+@router.delete("/{name}", status_code=204)
+async def remove_layout(name: str):
+    """Unregister a layout; its pages take the generic path again."""
+    if not await asyncio.to_thread(layout_registry.remove, name):
+        raise HTTPException(status_code=404, detail=f"Unknown layout {name}")
@@ -1,46 +1,339 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException
-from fastapi.responses import JSONResponse
-import os
-import shutil
-from pathlib import Path
-from ..services.contour_processing import ContourProcessingService
-from ..config import UPLOAD_DIR
+from fastapi import APIRouter, UploadFile, File, HTTPException, Request, Body, Query, Header
+from fastapi.responses import JSONResponse, StreamingResponse
+from typing import List, Optional
+import asyncio
+import json
+from pathlib import Path, PurePosixPath
+from ..services.contour_processing import ContourProcessingService, SHALLOW_DEPTHS
+from ..services.image_io import read_upload, release_upload, SpooledUpload, ImageTooLargeError, InvalidImageError
+from ..services.documents import is_document, page_count
+from ..services.batch import is_zip, zip_members, read_zip_member
+from ..services.metrics import observe_page, server_timing
+from ..services.profiling import profile_modes
+from ..services.worker_pool import ProcessingPool, PoolBusyError, JobTimeoutError, JobCancelledError
+from ..config import (MAX_DOCUMENT_PAGES, BATCH_MAX_FILES, BATCH_MAX_UPLOAD_BYTES, BATCH_BUSY_BACKOFF,
+                      BATCH_BUSY_BACKOFF_MAX, JOB_TIMEOUT_SECONDS, SHALLOW_POOL_SIZE, SHALLOW_QUEUE_SIZE)
 
 router = APIRouter()
-processing_service = ContourProcessingService()
+processing_pool = ProcessingPool(ContourProcessingService.create_loaded)
+# Box and face checks: the same service in thread mode, without waiting for the OCR models to load
+shallow_pool = ProcessingPool(ContourProcessingService.shared, kind="thread", workers=SHALLOW_POOL_SIZE,
+                              queue_size=SHALLOW_QUEUE_SIZE)
+
+def pool_for(overrides: dict) -> ProcessingPool:
+    """The pool a call with these setting overrides runs on (validates them)."""
+    depth = ContourProcessingService.effective_settings(overrides)["PIPELINE_DEPTH"]
+    return shallow_pool if depth in SHALLOW_DEPTHS else processing_pool
+
+async def _run_when_free(method: str, *args, **kwargs):
+    """
+    ``processing_pool.run`` for streamed jobs: a full pool (e.g. busy with
+    other requests) is waited out with a growing backoff instead of failing
+    the item, until JOB_TIMEOUT_SECONDS have passed.
+    """
+    delay = BATCH_BUSY_BACKOFF
+    deadline = asyncio.get_running_loop().time() + JOB_TIMEOUT_SECONDS
+    while True:
+        try:
+            return await processing_pool.run(method, *args, **kwargs)
+        except PoolBusyError:
+            if asyncio.get_running_loop().time() + delay > deadline:
+                raise
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, BATCH_BUSY_BACKOFF_MAX)
+
+async def _run_page(upload, index: int, base_name: str, overrides: dict) -> dict:
+    try:
+        result = await _run_when_free("process_document_page", upload, index, f"{base_name}_p{index + 1}",
+                                      overrides=overrides)
+        observe_page(result)
+        return result
+    except Exception as e:
+        return {"success": False, "page": index + 1, "error": str(e)}
+
+async def _stream_document(upload, total_pages: int, base_name: str, overrides: dict):
+    """
+    Yield one NDJSON line per page as pages finish. At most one page per
+    worker is in flight, so memory stays flat however long the document is.
+    """
+    pending = set()
+    next_page = 0
+    try:
+        while next_page < total_pages or pending:
+            while next_page < total_pages and len(pending) < processing_pool.workers:
+                pending.add(asyncio.ensure_future(_run_page(upload, next_page, base_name, overrides)))
+                next_page += 1
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in sorted(done, key=lambda t: t.result()["page"]):
+                yield json.dumps(task.result()) + "\n"
+    finally:
+        # Client went away (or we are done): drop whatever is still queued
+        for task in pending:
+            task.cancel()
+        release_upload(upload)
+
+async def _batch_jobs(sources: list, batch_name: str, spooled: list):
+    """
+    Yield ``(source, page, method, args)`` for every image and document page
+    in the batch. ZIP members are extracted one at a time as they are
+    scheduled; spooled ones are collected in ``spooled`` for cleanup.
+    """
+    for filename, upload in sources:
+        if is_zip(upload):
+            members = [(name, upload) for name in await asyncio.to_thread(zip_members, upload)]
+        else:
+            members = [(filename, None)]
+        for name, archive in members:
+            base_name = f"{batch_name}/{PurePosixPath(name).stem}"
+            try:
+                item = upload if archive is None else await asyncio.to_thread(read_zip_member, archive, name)
+                if archive is not None and isinstance(item, SpooledUpload):
+                    spooled.append(item)
+                pages = await asyncio.to_thread(page_count, item) if is_document(item) else 0
+                if pages > MAX_DOCUMENT_PAGES:
+                    raise ImageTooLargeError(f"Document has {pages} pages, more than {MAX_DOCUMENT_PAGES}")
+            except Exception as e:
+                yield name, None, None, e
+                continue
+            if not pages:
+                yield name, None, "process_image", (item, base_name)
+            for index in range(pages):
+                yield name, index + 1, "process_document_page", (item, index, f"{base_name}_p{index + 1}")
+
+async def _run_batch_job(source: str, page, method, args):
+    if method is None:
+        return source, page, {"success": False, "error": str(args)}
+    try:
+        result = await _run_when_free(method, *args)
+        observe_page(result)
+        return source, page, result
+    except Exception as e:
+        return source, page, {"success": False, "error": str(e)}
+
+async def _stream_batch(sources: list, batch_name: str):
+    """
+    Yield one NDJSON line per extracted photo as soon as its image or page is
+    done, one line per failed item, and a closing summary line. Jobs are
+    spread over the pool with at most one per worker in flight.
+    """
+    spooled = []
+    jobs = _batch_jobs(sources, batch_name, spooled)
+    pending = set()
+    exhausted = False
+    counts = {"items": 0, "photos": 0, "errors": 0}
+    try:
+        while not exhausted or pending:
+            while not exhausted and len(pending) < processing_pool.workers:
+                try:
+                    job = await jobs.__anext__()
+                except StopAsyncIteration:
+                    exhausted = True
+                    break
+                pending.add(asyncio.ensure_future(_run_batch_job(*job)))
+            if not pending:
+                break
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                source, page, result = task.result()
+                counts["items"] += 1
+                location = {"source": source} if page is None else {"source": source, "page": page}
+                if not result.get("success"):
+                    counts["errors"] += 1
+                    yield json.dumps({**location, "error": result.get("error")}) + "\n"
+                    continue
+                for photo in result["results"]:
+                    counts["photos"] += 1
+                    yield json.dumps({**location, **photo}) + "\n"
+        yield json.dumps({"done": True, **counts}) + "\n"
+    finally:
+        for task in pending:
+            task.cancel()
+        await jobs.aclose()
+        for upload in spooled:
+            release_upload(upload)
+        for _, upload in sources:
+            release_upload(upload)
+
+def _query_overrides(output: Optional[str], image_format: Optional[str], ocr: Optional[str],
+                     depth: Optional[str] = None) -> dict:
+    overrides = {}
+    if depth is not None:
+        overrides["PIPELINE_DEPTH"] = depth
+    if output is not None:
+        overrides["OUTPUT_MODE"] = output
+    if image_format is not None:
+        overrides["OUTPUT_FORMAT"] = image_format
+    if ocr is not None:
+        overrides["OCR_BACKEND"] = ocr
+    return overrides
 
 @router.post("/process-photos")
-async def process_photos(file: UploadFile = File(...)):
+async def process_photos(
+    request: Request,
+    file: UploadFile = File(...),
+    output: Optional[str] = Query(None, description='"disk", "inline" (base64 crops in the response) or "none"'),
+    image_format: Optional[str] = Query(None, alias="format", description='"png", "jpeg" or "webp"'),
+    ocr: Optional[str] = Query(None, description='"easyocr" or "tesseract"'),
+    depth: Optional[str] = Query(None, description='Last stage to run: "boxes", "faces", "names" or "crops"'),
+    x_profile: Optional[str] = Header(None, description='"cpu", "memory" or "cpu,memory" (admin only)'),
+    x_profile_token: Optional[str] = Header(None),
+):
     """
     Process an uploaded image to detect photos and associated text.
     
     The endpoint:
-    1. Saves the uploaded file temporarily
-    2. Processes it using the contour detection algorithm
+    1. Reads the upload into memory (size-limited)
+    2. Decodes and processes it on the worker pool using the contour detection algorithm
     3. Returns the processing results
+
+    Multi-page PDFs and TIFFs are answered with an NDJSON stream, one line
+    per page in completion order, each page rasterized inside a worker.
+    ``output``, ``format`` and ``ocr`` override OUTPUT_MODE, OUTPUT_FORMAT
+    and OCR_BACKEND. ``depth`` (PIPELINE_DEPTH) stops the pipeline after
+    that stage: e.g. ``depth=faces`` returns the face-confirmed boxes
+    without running OCR or writing crops.
+    With profiling enabled, ``X-Profile`` plus the admin ``X-Profile-Token``
+    profiles a single image; the response then carries a ``profile`` summary.
     """
+    upload = None
+    streaming = False
     try:
-        # Create a unique filename for the upload
-        file_extension = os.path.splitext(file.filename)[1]
-        temp_path = os.path.join(UPLOAD_DIR, f"temp_{Path(file.filename).stem}{file_extension}")
-        
-        # Save uploaded file
-        with open(temp_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        
-        # Process the image
-        try:
-            results = await processing_service.process_image(
-                temp_path,
-                f"processed_{Path(file.filename).stem}"
+        profile = profile_modes(x_profile, x_profile_token)
+        overrides = _query_overrides(output, image_format, ocr, depth)
+        pool = pool_for(overrides)
+        upload = await read_upload(file)
+        base_name = f"processed_{Path(file.filename).stem}"
+
+        total_pages = await asyncio.to_thread(page_count, upload) if is_document(upload) else 0
+        if total_pages and profile:
+            raise ValueError("Profiling is only available for single images")
+        if total_pages > 1:
+            if total_pages > MAX_DOCUMENT_PAGES:
+                raise ImageTooLargeError(f"Document has {total_pages} pages, more than {MAX_DOCUMENT_PAGES}")
+            streaming = True
+            return StreamingResponse(
+                _stream_document(upload, total_pages, base_name, overrides),
+                media_type="application/x-ndjson",
+            )
+
+        if total_pages:
+            # A one-page PDF or TIFF is answered like an image, not streamed
+            results = await pool.run(
+                "process_document_page",
+                upload,
+                0,
+                base_name,
+                overrides=overrides,
+                request=request,
             )
-            
-            return JSONResponse(content=results)
-            
-        finally:
-            # Clean up temporary file
-            if os.path.exists(temp_path):
-                os.remove(temp_path)
-                
+        else:
+            results = await pool.run(
+                "process_image",
+                upload,
+                base_name,
+                overrides=overrides,
+                request=request,
+                profile=profile,
+            )
+        observe_page(results)
+        return JSONResponse(content=results, headers={"Server-Timing": server_timing(results)})
+
+    except PermissionError as e:
+        raise HTTPException(status_code=403, detail=str(e))
+    except ImageTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except PoolBusyError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except JobTimeoutError as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    except JobCancelledError as e:
+        # The client is gone; the status code is only seen in access logs.
+        raise HTTPException(status_code=499, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        # A streamed document releases its upload when the stream ends
+        if upload is not None and not streaming:
+            release_upload(upload)
+
+@router.post("/process-batch")
+async def process_batch(files: List[UploadFile] = File(...)):
+    """
+    Process many images (or one or more ZIPs of them) in a single request.
+
+    Images and document pages are scheduled across the worker pool and the
+    response is an NDJSON stream: one line per extracted photo (``source``,
+    ``page`` for documents, ``name``, ``bbox``, ``image_path``), an
+    ``error`` line per item that failed and a final ``{"done": true, ...}``
+    summary. Crops land under one ``processed_batch_<name>`` folder.
+    """
+    sources = []
+    streaming = False
+    try:
+        total = 0
+        for file in files:
+            upload = await read_upload(file, BATCH_MAX_UPLOAD_BYTES)
+            sources.append((file.filename, upload))
+            total += len(await asyncio.to_thread(zip_members, upload)) if is_zip(upload) else 1
+            if total > BATCH_MAX_FILES:
+                raise ImageTooLargeError(f"Batch has more than {BATCH_MAX_FILES} files")
+
+        batch_name = f"processed_batch_{Path(files[0].filename).stem}"
+        streaming = True
+        return StreamingResponse(_stream_batch(sources, batch_name), media_type="application/x-ndjson")
+
+    except ImageTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except InvalidImageError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    finally:
+        # The stream releases the uploads when it ends
+        if not streaming:
+            for _, upload in sources:
+                release_upload(upload)
+
+@router.post("/reprocess")
+async def reprocess(
+    request: Request,
+    image_hash: str = Body(...),
+    settings: dict = Body(default={}),
+    name: str = Body(default="reprocessed"),
+):
+    """
+    Re-run the pipeline on an earlier upload (``image_hash`` from its response)
+    with some settings changed, e.g. ``{"TEXT_SEARCH_HEIGHT": 90}``. Only the
+    stages that depend on the changed settings are recomputed.
+    """
+    try:
+        results = await pool_for(settings).run(
+            "reprocess",
+            image_hash,
+            f"processed_{name}",
+            overrides=settings,
+            request=request,
+        )
+        observe_page(results)
+        return JSONResponse(content=results, headers={"Server-Timing": server_timing(results)})
+
+    except LookupError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except PoolBusyError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except JobTimeoutError as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    except JobCancelledError as e:
+        raise HTTPException(status_code=499, detail=str(e))
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/cache-stats")
+async def cache_stats():
+    """Result cache hit/miss counters (one worker's view when using a process pool)."""
+    if processing_pool.kind == "thread":
+        # The service the thread pool uses, whether or not its models have loaded yet
+        return ContourProcessingService.shared().cache_stats()
+    return await processing_pool.run("cache_stats")
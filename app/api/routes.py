@@ -1,10 +1,50 @@
-from fastapi import APIRouter, UploadFile, File
+from fastapi import APIRouter, UploadFile, File, HTTPException, Query, Request
 from fastapi.responses import JSONResponse
-from app.services.contour_service import detect_contours
+from pathlib import Path
+from ..services.image_io import read_upload, release_upload, ImageTooLargeError
+from ..services.metrics import observe_page, server_timing
+from ..services.worker_pool import PoolBusyError, JobTimeoutError, JobCancelledError
+from .photo_routes import pool_for
 
 router = APIRouter()
 
 @router.post("/detect")
-async def detect(file: UploadFile = File(...)):
-    coords = await detect_contours(file)
-    return JSONResponse(content={"detected_boxes": coords})
+async def detect(
+    request: Request,
+    file: UploadFile = File(...),
+    depth: str = Query("boxes", description='Last stage to run: "boxes", "faces", "names" or "crops"'),
+):
+    """
+    Photo boxes of an image from the processing pipeline, run only as deep as
+    ``depth``: ``boxes`` (candidates, no models), ``faces`` (face-confirmed),
+    ``names`` (plus OCR'd names) or ``crops`` (the full /process-photos run).
+    ``detected_boxes`` lists the boxes; the rest is the pipeline result.
+    """
+    upload = None
+    try:
+        overrides = {"PIPELINE_DEPTH": depth}
+        pool = pool_for(overrides)
+        upload = await read_upload(file)
+        result = await pool.run(
+            "process_image",
+            upload,
+            f"detected_{Path(file.filename).stem}",
+            overrides=overrides,
+            request=request,
+        )
+        observe_page(result)
+    except ImageTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except PoolBusyError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except JobTimeoutError as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    except JobCancelledError as e:
+        raise HTTPException(status_code=499, detail=str(e))
+    finally:
+        if upload is not None:
+            release_upload(upload)
+    content = {"detected_boxes": [item["bbox"] for item in result["results"]], **result}
+    return JSONResponse(content=content, headers={"Server-Timing": server_timing(result)})
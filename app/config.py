@@ -19,8 +19,186 @@ MAX_ASPECT_RATIO = 0.85
 TEXT_SEARCH_HEIGHT = 70
 TEXT_SEARCH_WIDTH_TOLERANCE = 40
 EASYOCR_CONFIDENCE_THRESHOLD = 0.3
+# Photo box detector: "contours" (findContours + per-contour loop) or
+# "components" (connectedComponentsWithStats + vectorized filtering)
+PHOTO_DETECTOR = "contours"
+OCR_LANGUAGES = ['id', 'en']
 
-# Create necessary directories
-os.makedirs(UPLOAD_DIR, exist_ok=True)
-os.makedirs(RESULT_DIR, exist_ok=True)
-os.makedirs(TEMPLATE_DIR, exist_ok=True)
\ No newline at end of file
+# Detection resolution: "full" finds photo boxes on the full page with the
+# absolute MIN_AREA/MAX_AREA above; "normalized" finds them on a copy whose
+# longest side is at most DETECTION_MAX_SIDE, with area limits as fractions
+# of the page area, and maps the boxes back for cropping. Same boxes for any
+# scan DPI, and the blur/threshold cost no longer grows with it
+DETECTION_RESOLUTION = "full"
+DETECTION_MAX_SIDE = 1000
+# MIN_AREA/MAX_AREA relative to the 2000x1414 templates
+MIN_AREA_FRACTION = 0.007
+MAX_AREA_FRACTION = 0.053
+
+# Registered form layouts (POST /api/layouts): a page that matches one skips
+# contour search and crops that layout's photo slots and reads its name fields
+# directly. Pages are matched on a thumbnail (longest side LAYOUT_THUMB_SIDE)
+# against the printed form with slots and name fields masked out, shifted by
+# up to LAYOUT_MAX_SHIFT of the page; pages scoring below
+# LAYOUT_MATCH_THRESHOLD (0-1), or whose aspect ratio differs by more than
+# LAYOUT_ASPECT_TOLERANCE, take the generic path
+LAYOUT_MATCHING = True
+LAYOUT_DIR = os.path.join(BASE_DIR, "layouts")
+LAYOUT_THUMB_SIDE = 160
+LAYOUT_MAX_SHIFT = 0.05
+LAYOUT_MATCH_THRESHOLD = 0.8
+LAYOUT_ASPECT_TOLERANCE = 0.05
+
+# Face check: "page" runs the cascade once on a downscaled grayscale page and
+# assigns faces to boxes by containment, "crop" runs it per box on a downscaled
+# gray crop with face size bounds, "full" runs it per full-resolution crop
+FACE_CHECK_MODE = "crop"
+FACE_PAGE_MAX_SIDE = 1200  # longest page side for "page" mode
+FACE_CROP_WIDTH = 120  # crop width for "crop" mode
+# Expected face size as a fraction of the photo box width
+FACE_MIN_RATIO = 0.2
+FACE_MAX_RATIO = 1.0
+
+# OCR scope: "band" reads only the name strip under each face-confirmed photo,
+# "recognize" sends those strips straight to the recognizer (no CRAFT detection),
+# "page" reads the whole page (slower, kept for comparison)
+OCR_MODE = "band"
+# The strip must cover the match window (TEXT_SEARCH_HEIGHT / TEXT_SEARCH_WIDTH_TOLERANCE)
+# with room to spare so words at its edge are read whole
+OCR_BAND_HEIGHT = 90
+OCR_BAND_MARGIN = 60
+# "recognize" mode: strips per recognizer batch, and whether an empty or
+# low-confidence strip is retried with detector + recognizer
+OCR_RECOGNIZE_BATCH_SIZE = 16
+OCR_RECOGNIZE_FALLBACK = True
+
+# OCR engine: "easyocr" or "tesseract" (pytesseract plus the tesseract binary
+# with the "ind" and "eng" language data). Selectable per request; engines
+# other than this default are loaded on first use
+OCR_BACKEND = "easyocr"
+# Tesseract reads each name band on its own process pool, after a 2x cubic
+# upscale and Otsu binarization, with only letters and spaces allowed
+TESSERACT_LANGUAGES = "ind+eng"
+TESSERACT_CONFIG = "--psm 6"  # a uniform block of text: one or two caption lines
+TESSERACT_WHITELIST = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ "
+TESSERACT_UPSCALE = 2
+TESSERACT_CONFIDENCE_THRESHOLD = 0.0  # 0-1; the whitelist already drops most noise
+TESSERACT_WORKERS = min(4, os.cpu_count() or 1)
+
+# Pipeline depth: the last stage a request needs. "boxes" returns the photo
+# candidates, "faces" the face-confirmed ones, "names" adds their OCR'd names
+# (no crops) and "crops" also saves or inlines the crops. Stages past it never
+# run; selectable per request (?depth= on /api/detect and /process-photos)
+PIPELINE_DEPTH = "crops"
+
+# Crop output. "disk" writes crops and JSON sidecars under RESULT_DIR, "inline"
+# returns base64 crops in the response and "none" returns only names and boxes
+OUTPUT_MODE = "disk"
+OUTPUT_FORMAT = "png"  # "png", "jpeg" or "webp"
+OUTPUT_PNG_COMPRESSION = None  # 0-9; None keeps OpenCV's default (level 1, RLE), the fastest that compresses
+OUTPUT_JPEG_QUALITY = 90  # about 10x faster to encode than PNG for portrait crops, and far smaller
+OUTPUT_WEBP_QUALITY = 90
+OUTPUT_WRITER_THREADS = 2  # crops are encoded and written in parallel; 0 does it in the calling thread
+# Each run folder gets one manifest.jsonl (a line per photo: name, words with
+# confidences, bbox, crop path), fsynced once. The per-name JSON files of
+# earlier versions are only written when this is on
+OUTPUT_LEGACY_SIDECARS = False
+
+# Run folders: RESULT_DIR/YYYY/MM/DD/HH/<run id>-<name>. A background job
+# deletes runs older than RESULT_RETENTION_DAYS, then the oldest runs while
+# the total exceeds RESULT_RETENTION_MAX_BYTES (None disables either limit)
+RESULT_RETENTION_DAYS = 30
+RESULT_RETENTION_MAX_BYTES = None
+RESULT_GC_INTERVAL_SECONDS = 3600
+
+# On-demand profiling: a request with "X-Profile: cpu,memory" and an
+# "X-Profile-Token" equal to PROFILING_ADMIN_TOKEN runs under cProfile and/or
+# tracemalloc, writes the raw profile into its run folder and reports the
+# top entries in the response. Off unless enabled and a token is set
+PROFILING_ENABLED = False
+PROFILING_ADMIN_TOKEN = None
+PROFILING_TOP_N = 20
+PROFILING_TRACEMALLOC_FRAMES = 1  # frames kept per allocation; more show callers but cost more
+
+# Upload limits
+MAX_UPLOAD_BYTES = 50 * 1024 * 1024
+MAX_IMAGE_PIXELS = 80_000_000  # checked from the image header before decoding
+UPLOAD_SPOOL_THRESHOLD = 16 * 1024 * 1024  # larger bodies are spooled to disk and memory-mapped
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Multi-page documents (PDF, TIFF): pages are rasterized one at a time inside the workers
+DOCUMENT_RASTER_DPI = 150  # the area limits above are tuned for roughly this resolution
+MAX_DOCUMENT_PAGES = 200
+
+# Batch uploads (many files or one ZIP): each image or document page is one pool job
+BATCH_MAX_FILES = 500  # uploaded files plus ZIP members
+BATCH_MAX_UPLOAD_BYTES = 500 * 1024 * 1024  # per uploaded file, so a ZIP can hold a full roster
+# A batch or document job finding the pool full waits and retries, doubling
+# the wait from BATCH_BUSY_BACKOFF up to BATCH_BUSY_BACKOFF_MAX seconds, and
+# fails only once it has waited JOB_TIMEOUT_SECONDS in total
+BATCH_BUSY_BACKOFF = 0.1
+BATCH_BUSY_BACKOFF_MAX = 2.0
+
+# Result cache: repeated uploads with the same bytes and settings reuse the stored result
+RESULT_CACHE_ENABLED = True
+RESULT_CACHE_DIR = os.path.join(BASE_DIR, "cache", "results")
+RESULT_CACHE_MAX_BYTES = 64 * 1024 * 1024  # disk tier, least recently used entries go first
+RESULT_CACHE_MEMORY_ENTRIES = 256
+PIPELINE_VERSION = 2  # bump when a code change alters results, to invalidate cached ones
+
+# Stage cache: upload bytes, boxes, face checks and OCR words per upload, so
+# reprocessing with new settings only recomputes the stages that depend on them
+STAGE_CACHE_ENABLED = True
+STAGE_CACHE_DIR = os.path.join(BASE_DIR, "cache", "stages")
+STAGE_CACHE_MAX_BYTES = 1024 * 1024 * 1024
+
+# Worker pool
+WORKER_POOL_KIND = "thread"  # "thread" shares one loaded model, "process" loads one per worker
+WORKER_POOL_SIZE = os.cpu_count() or 1
+WORKER_QUEUE_SIZE = 8  # jobs allowed to wait once every worker is busy
+JOB_TIMEOUT_SECONDS = 120
+DISCONNECT_POLL_INTERVAL = 0.5
+# Calls with PIPELINE_DEPTH "boxes" or "faces" need no OCR, so they run on a
+# small thread pool of their own instead of queueing behind full pages
+SHALLOW_POOL_SIZE = 2
+SHALLOW_QUEUE_SIZE = 16
+
+# EasyOCR on CPU. Each worker's torch ops use OCR_TORCH_THREADS threads (the
+# default splits the cores between the pool workers, so concurrent requests
+# do not oversubscribe them) and OCR_TORCH_INTEROP_THREADS inter-op threads;
+# None keeps torch's own default. OCR_QUANTIZE runs the recognizer with
+# dynamic int8 weights (EasyOCR's own default on CPU); False keeps it fp32
+OCR_TORCH_THREADS = max(1, (os.cpu_count() or 1) // WORKER_POOL_SIZE)
+OCR_TORCH_INTEROP_THREADS = 1
+OCR_QUANTIZE = True
+
+# Pre-fork server (python -m app.prefork): the parent loads the models once
+# and forks PREFORK_WORKERS HTTP workers that share them copy-on-write. Each
+# worker gets PREFORK_THREADS_PER_WORKER torch/OpenCV threads per request and
+# a processing pool of PREFORK_POOL_SIZE request slots; None sizes it so
+# workers x slots x threads matches the cores
+PREFORK_HOST = "0.0.0.0"
+PREFORK_PORT = 8000
+PREFORK_WORKERS = 2
+PREFORK_THREADS_PER_WORKER = max(1, (os.cpu_count() or 1) // PREFORK_WORKERS)
+PREFORK_POOL_SIZE = None
+
+# Job queue: submitted jobs and their inputs are kept on disk (SQLite) and
+# drained in the background, so they outlive the request and a restart
+JOB_QUEUE_DIR = os.path.join(BASE_DIR, "jobs")
+JOB_QUEUE_DB = os.path.join(JOB_QUEUE_DIR, "jobs.sqlite3")
+JOB_QUEUE_CONCURRENCY = max(1, WORKER_POOL_SIZE // 2)  # leaves workers for the synchronous routes
+JOB_QUEUE_MAX_ATTEMPTS = 3  # a job found running after a crash is retried until this many starts
+JOB_QUEUE_POLL_INTERVAL = 1.0
+# Per image or document page; far above JOB_TIMEOUT_SECONDS, since nobody
+# waits on the request. A job that times out fails for good (not retried)
+JOB_QUEUE_TIMEOUT_SECONDS = 30 * 60
+
+
+
+def ensure_directories():
+    """Create the working directories; called at application startup."""
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    os.makedirs(RESULT_DIR, exist_ok=True)
+    os.makedirs(TEMPLATE_DIR, exist_ok=True)
+    os.makedirs(JOB_QUEUE_DIR, exist_ok=True)
@@ -1,9 +1,81 @@
-from fastapi import FastAPI
+import asyncio
+from contextlib import asynccontextmanager
+import time
+from fastapi import FastAPI, Request
+from app.config import ensure_directories, RESULT_GC_INTERVAL_SECONDS
 from app.api.routes import router as api_router
-from app.api.photo_routes import router as photo_router
+from app.api.photo_routes import router as photo_router, processing_pool, shallow_pool
+from app.api.health_routes import router as health_router, startup_timings
+from app.api.job_routes import router as job_router, job_runner
+from app.api.layout_routes import router as layout_router
+from app.services.timing import StageTimer
+from app.services.run_store import RunStore
+from app.services.metrics import requests_total, request_seconds
+
+
+async def _load_models(timer: StageTimer):
+    """Load and warm up the worker pool without holding up the server start."""
+    try:
+        with timer.stage("models"):
+            await asyncio.get_running_loop().run_in_executor(None, processing_pool.start)
+    except Exception as e:
+        # Stay unready; the first request will retry the load
+        print(f"Model loading failed: {e}")
+    finally:
+        startup_timings.update(timer.durations)
+        print("Startup timings (ms): " + ", ".join(f"{k}={v:.0f}" for k, v in timer.durations.items()))
+
+
+async def _collect_runs(store: RunStore):
+    """Apply the result retention limits now and then, off the event loop."""
+    while True:
+        try:
+            removed = await asyncio.to_thread(store.collect)
+            if removed["removed_runs"]:
+                print(f"Result retention: removed {removed['removed_runs']} runs ({removed['removed_bytes']} bytes)")
+        except Exception as e:
+            print(f"Result retention failed: {e}")
+        await asyncio.sleep(RESULT_GC_INTERVAL_SECONDS)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    timer = StageTimer()
+    with timer.stage("directories"):
+        ensure_directories()
+    # /healthz answers right away; /readyz turns 200 once this finishes
+    app.state.model_loading = asyncio.create_task(_load_models(timer))
+    await job_runner.start()
+    app.state.run_collector = asyncio.create_task(_collect_runs(RunStore()))
+    yield
+    app.state.run_collector.cancel()
+    await job_runner.stop()
+    app.state.model_loading.cancel()
+    processing_pool.shutdown(wait=False)
+    shallow_pool.shutdown(wait=False)
+
+
+app = FastAPI(title="Contour Detection Service", lifespan=lifespan)
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # Label by route template, not raw path, to keep label values bounded
+        route = request.scope.get("route")
+        path = getattr(route, "path", "unmatched")
+        requests_total.inc(route=path, method=request.method, status=status)
+        request_seconds.observe(time.perf_counter() - start, route=path)
 
-app = FastAPI(title="Contour Detection Service")
 
 # Register API routes
+app.include_router(health_router, tags=["health"])
 app.include_router(api_router, prefix="/api")
 app.include_router(photo_router, prefix="/api/photos", tags=["photos"])
+app.include_router(job_router, prefix="/api/jobs", tags=["jobs"])
+app.include_router(layout_router, prefix="/api/layouts", tags=["layouts"])
@@ -0,0 +1,172 @@
+"""
+Pre-fork server: load the models once, then fork the HTTP workers.
+
+    python -m app.prefork [--host 0.0.0.0] [--port 8000] [--workers 2] [--threads 4] [--pool-size 1]
+
+The parent imports the app, loads and warms up the processing service (Haar
+cascade, EasyOCR/torch weights), binds the listening socket and forks the
+workers, each running uvicorn on the shared socket. The loaded models live
+in pages the workers share copy-on-write, so an extra worker costs its own
+heap and buffers rather than another copy of the weights. ``gc.freeze()``
+moves everything loaded so far out of the collector's reach, so the
+workers' garbage collections do not write to (and so copy) those pages.
+
+Workers that die are forked again from the loaded parent. SIGTERM or SIGINT
+stops the workers gracefully and then the parent.
+"""
+import argparse
+import gc
+import os
+import signal
+import socket
+import sys
+import time
+import traceback
+from typing import Dict
+import cv2
+import uvicorn
+from app.config import *
+
+WORKER_STOP_TIMEOUT = 30
+RESPAWN_DELAY = 1.0
+WAIT_POLL_INTERVAL = 0.1
+
+
+def _bind(host: str, port: int) -> socket.socket:
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def _serve(app, sock: socket.socket, threads: int):
+    """Worker: apply the thread budget and serve on the inherited socket."""
+    from app.services.ocr_backends import configure_torch_threads
+
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    gc.enable()
+    configure_torch_threads(threads, None)
+    cv2.setNumThreads(threads)
+    uvicorn.Server(uvicorn.Config(app, lifespan="on")).run(sockets=[sock])
+
+
+def _fork_worker(app, sock: socket.socket, threads: int) -> int:
+    pid = os.fork()
+    if pid == 0:
+        code = 0
+        try:
+            _serve(app, sock, threads)
+        except BaseException:
+            traceback.print_exc()
+            code = 1
+        finally:
+            # Skip the parent's atexit handlers and buffered output
+            os._exit(code)
+    return pid
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--host", default=PREFORK_HOST)
+    parser.add_argument("--port", type=int, default=PREFORK_PORT)
+    parser.add_argument("--workers", type=int, default=PREFORK_WORKERS)
+    parser.add_argument("--threads", type=int, default=PREFORK_THREADS_PER_WORKER,
+                        help="torch and OpenCV threads per worker")
+    parser.add_argument("--pool-size", type=int, default=PREFORK_POOL_SIZE,
+                        help="concurrent requests per worker (default: cores // (workers * threads))")
+    args = parser.parse_args()
+    pool_size = args.pool_size or max(1, (os.cpu_count() or 1) // (args.workers * args.threads))
+    if WORKER_POOL_KIND != "thread":
+        sys.exit('Pre-fork mode needs WORKER_POOL_KIND = "thread"; the forked workers are the processes')
+
+    from app.services.ocr_backends import configure_torch_threads
+
+    # Single-threaded while loading: no OpenMP thread pool exists at fork time
+    # (forking one can deadlock the child's first parallel region)
+    configure_torch_threads(1, OCR_TORCH_INTEROP_THREADS)
+    cv2.setNumThreads(1)
+    # Nothing is collected until the freeze, so loading leaves no freed holes
+    # between shared objects that the workers would later fill (and copy)
+    gc.disable()
+    from app.main import app
+    from app.api.job_routes import job_queue, job_runner
+    from app.api.photo_routes import processing_pool
+    from app.services.contour_processing import ContourProcessingService
+
+    start = time.perf_counter()
+    service = ContourProcessingService.preload()
+    print(f"Models loaded in the parent in {time.perf_counter() - start:.1f}s")
+    # Worker processes and their pipes do not survive a fork: each HTTP worker
+    # starts its own Tesseract pool on first use
+    for backend in service.ocr_backends.values():
+        backend.shutdown()
+
+    # Recover once here; a worker doing it would requeue its siblings' running jobs
+    recovered = job_queue.recover()
+    if recovered:
+        print(f"Job queue: {recovered} job(s) interrupted by the last shutdown were requeued or failed")
+    job_runner.recover_on_start = False
+    # Each request slot runs --threads torch/OpenCV threads: without this every worker would
+    # get WORKER_POOL_SIZE (one per core) slots and oversubscribe the cores workers x threads times
+    processing_pool.workers = pool_size
+    job_runner.concurrency = max(1, pool_size // 2)
+
+    sock = _bind(args.host, args.port)
+    gc.freeze()
+    workers: Dict[int, int] = {}
+    for slot in range(args.workers):
+        workers[_fork_worker(app, sock, args.threads)] = slot
+    print(f"Serving on {args.host}:{args.port} with {args.workers} workers "
+          f"({pool_size} request slots of {args.threads} threads each): pids {', '.join(map(str, workers))}")
+
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    deadline = None
+    while workers:
+        if stopping and deadline is None:
+            deadline = time.monotonic() + WORKER_STOP_TIMEOUT
+        # Polled: a blocking waitpid resumes after the signal handler (PEP 475),
+        # so a stop would never reach the SIGKILL deadline
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            break
+        if pid == 0:
+            if deadline is not None and time.monotonic() > deadline:
+                for pid in workers:
+                    try:
+                        os.kill(pid, signal.SIGKILL)
+                    except ProcessLookupError:
+                        pass
+                deadline = float("inf")
+            time.sleep(WAIT_POLL_INTERVAL)
+            continue
+        slot = workers.pop(pid, None)
+        if slot is None or stopping:
+            continue
+        print(f"Worker {pid} exited with status {os.waitstatus_to_exitcode(status)}; forking a new one")
+        time.sleep(RESPAWN_DELAY)
+        if not stopping:
+            workers[_fork_worker(app, sock, args.threads)] = slot
+
+    sock.close()
+
+
+if __name__ == "__main__":
+    main()
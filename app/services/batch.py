@@ -0,0 +1,56 @@
+import io
+import zipfile
+from pathlib import PurePosixPath
+from typing import List
+from ..config import *
+from .image_io import Upload, SpooledUpload, UploadBuffer, ImageTooLargeError, InvalidImageError
+
+ZIP_MAGIC = b"PK\x03\x04"
+BATCH_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp", ".tif", ".tiff", ".pdf")
+
+
+def is_zip(upload: Upload) -> bool:
+    if isinstance(upload, SpooledUpload):
+        with open(upload.path, "rb") as f:
+            return f.read(4) == ZIP_MAGIC
+    return upload[:4] == ZIP_MAGIC
+
+
+def _open_zip(upload: Upload) -> zipfile.ZipFile:
+    try:
+        return zipfile.ZipFile(upload.path if isinstance(upload, SpooledUpload) else io.BytesIO(upload))
+    except zipfile.BadZipFile as e:
+        raise InvalidImageError(f"Unreadable ZIP archive: {e}")
+
+
+def zip_members(upload: Upload) -> List[str]:
+    """Names of the images and documents in a ZIP, in archive order (read from its directory only)."""
+    with _open_zip(upload) as archive:
+        return [
+            info.filename for info in archive.infolist()
+            if not info.is_dir()
+            and not PurePosixPath(info.filename).name.startswith(".")
+            and "__MACOSX" not in PurePosixPath(info.filename).parts
+            and PurePosixPath(info.filename).suffix.lower() in BATCH_EXTENSIONS
+        ]
+
+
+def read_zip_member(upload: Upload, name: str, max_bytes: int = MAX_UPLOAD_BYTES) -> Upload:
+    """
+    Extract one ZIP member as an upload body (spooled to disk when large).
+
+    The size limit is enforced on the decompressed stream, not on the size
+    the archive claims.
+    """
+    with _open_zip(upload) as archive:
+        if archive.getinfo(name).file_size > max_bytes:
+            raise ImageTooLargeError(f"{name} exceeds {max_bytes} bytes")
+        buffer = UploadBuffer(max_bytes)
+        try:
+            with archive.open(name) as member:
+                for chunk in iter(lambda: member.read(UPLOAD_CHUNK_SIZE), b""):
+                    buffer.write(chunk)
+        except BaseException:
+            buffer.discard()
+            raise
+        return buffer.finish()
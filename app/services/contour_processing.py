@@ -1,21 +1,278 @@
-from typing import List, Dict, Tuple, Optional
+from typing import Callable, List, Dict, Tuple, Optional, Sequence, Union
 import cv2
 import numpy as np
 import os
 import urllib.request
 import re
-import easyocr
-import json
+import threading
+from contextlib import contextmanager
 from pathlib import Path
 from ..config import *
+from .worker_pool import check_cancelled
+from .timing import StageTimer
+from .image_io import Upload, decode_image, content_hash
+from .result_cache import ResultCache
+from .stage_cache import StageCache
+from .documents import load_page
+from .word_table import WordTable
+from .run_store import RunStore
+from .crop_writer import CropWriter, FORMATS, OUTPUT_MODES, MANIFEST_NAME, legacy_sidecar
+from .profiling import RequestProfiler
+from .ocr_backends import OCR_BACKENDS, OcrBackend
+from .layouts import LayoutRegistry
+
+# Stages a call can stop after (PIPELINE_DEPTH), in pipeline order
+PIPELINE_DEPTHS = ("boxes", "faces", "names", "crops")
+# Depths that need no OCR engine; such calls run on a pool of their own and keep no copy of the upload
+SHALLOW_DEPTHS = ("boxes", "faces")
+
+# Set by preload() in a pre-fork parent; forked workers share it copy-on-write
+_preloaded = None
+# The process's service, created unloaded by shared() and loaded by create_loaded()
+_shared = None
+_shared_lock = threading.Lock()
+
 
 class ContourProcessingService:
+    # Bands with less contrast than this hold no printed text
+    MIN_BAND_CONTRAST = 40
+    # Rows/columns inked more than this are form rules, not letters
+    RULE_FILL_RATIO = 0.9
+    # Blank rows allowed inside one text line (dots, accents), and the
+    # shortest run of inked rows taken for a line rather than a speck
+    LINE_GAP = 3
+    MIN_LINE_HEIGHT = 4
+    # Gaussian blur for "normalized" detection on a downscaled page; the 5x5
+    # used at full size would cover twice as much of each photo there
+    NORMALIZED_BLUR_SIZE = 3
+    # Faces wider than this fraction of the box are searched for first
+    LARGE_FACE_RATIO = 0.4
+    # Settings that change what process_image returns; part of every cache key
+    RESULT_SETTINGS = (
+        "PIPELINE_VERSION", "PIPELINE_DEPTH", "LAYOUT_MATCHING", "LAYOUT_MATCH_THRESHOLD",
+        "MIN_AREA", "MAX_AREA", "MIN_ASPECT_RATIO", "MAX_ASPECT_RATIO", "DETECTION_RESOLUTION",
+        "DETECTION_MAX_SIDE", "MIN_AREA_FRACTION", "MAX_AREA_FRACTION",
+        "TEXT_SEARCH_HEIGHT", "TEXT_SEARCH_WIDTH_TOLERANCE", "EASYOCR_CONFIDENCE_THRESHOLD",
+        "PHOTO_DETECTOR", "OCR_BACKEND", "OCR_LANGUAGES", "OCR_QUANTIZE", "OCR_MODE", "OCR_BAND_HEIGHT", "OCR_BAND_MARGIN",
+        "OCR_RECOGNIZE_FALLBACK", "FACE_CHECK_MODE", "FACE_PAGE_MAX_SIDE", "FACE_CROP_WIDTH",
+        "FACE_MIN_RATIO", "FACE_MAX_RATIO", "OUTPUT_MODE", "OUTPUT_FORMAT", "OUTPUT_PNG_COMPRESSION",
+        "OUTPUT_JPEG_QUALITY", "OUTPUT_WEBP_QUALITY", "OUTPUT_LEGACY_SIDECARS",
+        "TESSERACT_LANGUAGES", "TESSERACT_CONFIG", "TESSERACT_WHITELIST", "TESSERACT_UPSCALE",
+        "TESSERACT_CONFIDENCE_THRESHOLD",
+    )
+    # Fixed by the loaded models, or passed to the tesseract command line;
+    # cannot be overridden per call
+    FIXED_SETTINGS = ("PIPELINE_VERSION", "OCR_LANGUAGES", "OCR_QUANTIZE", "TESSERACT_LANGUAGES", "TESSERACT_CONFIG",
+                      "TESSERACT_WHITELIST")
+    # Also part of the OCR stage key in "recognize" mode, where strips are cut
+    # to the match window and retried when their word does not match
+    RECOGNIZE_STAGE_SETTINGS = ("TEXT_SEARCH_HEIGHT", "TEXT_SEARCH_WIDTH_TOLERANCE")
+    # Allowed values of the numeric settings, as (lowest, highest); None leaves that side open
+    SETTING_RANGES = {
+        "LAYOUT_MATCH_THRESHOLD": (0, 1), "MIN_AREA": (0, None), "MAX_AREA": (1, None),
+        "MIN_ASPECT_RATIO": (0, None), "MAX_ASPECT_RATIO": (0, None), "DETECTION_MAX_SIDE": (32, None),
+        "MIN_AREA_FRACTION": (0, 1), "MAX_AREA_FRACTION": (0, 1), "TEXT_SEARCH_HEIGHT": (0, None),
+        "TEXT_SEARCH_WIDTH_TOLERANCE": (0, None), "EASYOCR_CONFIDENCE_THRESHOLD": (0, 1),
+        "OCR_BAND_HEIGHT": (1, None), "OCR_BAND_MARGIN": (0, None), "FACE_PAGE_MAX_SIDE": (32, None),
+        "FACE_CROP_WIDTH": (24, None), "FACE_MIN_RATIO": (0, None), "FACE_MAX_RATIO": (0, None),
+        "OUTPUT_PNG_COMPRESSION": (0, 9), "OUTPUT_JPEG_QUALITY": (0, 100), "OUTPUT_WEBP_QUALITY": (1, 100),
+        "TESSERACT_UPSCALE": (1, 8), "TESSERACT_CONFIDENCE_THRESHOLD": (0, 1),
+    }
+    # Allowed values of the settings that pick a strategy
+    SETTING_CHOICES = {
+        "PIPELINE_DEPTH": PIPELINE_DEPTHS,
+        "DETECTION_RESOLUTION": ("full", "normalized"),
+        "PHOTO_DETECTOR": ("contours", "components"),
+        "OCR_MODE": ("band", "recognize", "page"),
+        "FACE_CHECK_MODE": ("page", "crop", "full"),
+        "OUTPUT_MODE": OUTPUT_MODES,
+        "OUTPUT_FORMAT": tuple(FORMATS),
+    }
+    # Settings each cached stage depends on, besides its upstream stage's output
+    STAGE_SETTINGS = {
+        "layout": ("PIPELINE_VERSION", "LAYOUT_MATCH_THRESHOLD"),
+        "boxes": ("PIPELINE_VERSION", "PHOTO_DETECTOR", "MIN_AREA", "MAX_AREA", "MIN_ASPECT_RATIO", "MAX_ASPECT_RATIO",
+                  "DETECTION_RESOLUTION", "DETECTION_MAX_SIDE", "MIN_AREA_FRACTION", "MAX_AREA_FRACTION"),
+        "faces": ("PIPELINE_VERSION", "FACE_CHECK_MODE", "FACE_PAGE_MAX_SIDE", "FACE_CROP_WIDTH", "FACE_MIN_RATIO", "FACE_MAX_RATIO"),
+        "ocr": ("PIPELINE_VERSION", "OCR_BACKEND", "OCR_LANGUAGES", "OCR_QUANTIZE", "OCR_MODE", "OCR_BAND_HEIGHT", "OCR_BAND_MARGIN",
+                "EASYOCR_CONFIDENCE_THRESHOLD", "OCR_RECOGNIZE_FALLBACK", "TESSERACT_LANGUAGES", "TESSERACT_CONFIG",
+                "TESSERACT_WHITELIST", "TESSERACT_UPSCALE", "TESSERACT_CONFIDENCE_THRESHOLD"),
+    }
+
     def __init__(self):
-        self._ensure_cascade_file()
-        self.face_cascade = cv2.CascadeClassifier(CASCADE_FILE)
-        print("Initializing EasyOCR...")
-        self.reader = easyocr.Reader(['id', 'en'])
-        print("EasyOCR initialized.")
+        # Models are loaded by load_models(), not here, so importing and
+        # constructing the service stays cheap.
+        self.face_cascade = None
+        # detectMultiScale is not safe on one classifier from several threads
+        self._thread_cascades = threading.local()
+        self.ocr_backends: Dict[str, OcrBackend] = {name: backend() for name, backend in OCR_BACKENDS.items()}
+        self.startup_timer = StageTimer()
+        self._load_lock = threading.Lock()
+        self.result_cache = ResultCache() if RESULT_CACHE_ENABLED else None
+        self.stage_cache = StageCache() if STAGE_CACHE_ENABLED else None
+        self.crop_writer = CropWriter()
+        self.run_store = RunStore()
+        self.layouts = LayoutRegistry()
+
+    @property
+    def loaded(self) -> bool:
+        return self.face_cascade is not None and self.ocr_backends[OCR_BACKEND].loaded
+
+    @property
+    def startup_timings(self) -> Dict[str, float]:
+        return dict(self.startup_timer.durations)
+
+    @staticmethod
+    def _coerce_setting(name: str, value, default):
+        """``value`` as the type of the setting's config default (JSON and form values may be strings)."""
+        try:
+            if isinstance(default, bool):
+                if isinstance(value, str) and value.lower() in ("true", "false"):
+                    return value.lower() == "true"
+                if not isinstance(value, bool):
+                    raise TypeError
+                return value
+            if value is None and default is None:
+                return None
+            if isinstance(default, int) or default is None:
+                # OUTPUT_PNG_COMPRESSION defaults to None but is otherwise a level
+                number = float(value)
+                if isinstance(value, bool) or not number.is_integer():
+                    raise TypeError
+                return int(number)
+            if isinstance(default, float):
+                if isinstance(value, bool):
+                    raise TypeError
+                number = float(value)
+                if not np.isfinite(number):
+                    raise TypeError
+                return number
+            if isinstance(default, str):
+                if not isinstance(value, str):
+                    raise TypeError
+                return value
+        except (TypeError, ValueError):
+            raise ValueError(f"Invalid value for {name}: {value!r}") from None
+        return value
+
+    @classmethod
+    def effective_settings(cls, overrides: Optional[Dict] = None) -> Dict:
+        """
+        Current values of the settings in RESULT_SETTINGS, with per-call
+        overrides applied. Overrides are converted to the type of the config
+        default; ValueError if one is unknown, fixed, or out of range.
+        """
+        settings = {name: globals()[name] for name in cls.RESULT_SETTINGS}
+        if overrides:
+            unknown = set(overrides) - set(settings)
+            if unknown:
+                raise ValueError(f"Unknown settings: {', '.join(sorted(unknown))}")
+            fixed = [name for name in cls.FIXED_SETTINGS if name in overrides and overrides[name] != settings[name]]
+            if fixed:
+                raise ValueError(f"Settings cannot be overridden per call: {', '.join(fixed)}")
+            for name, value in overrides.items():
+                if name not in cls.FIXED_SETTINGS:
+                    settings[name] = cls._coerce_setting(name, value, settings[name])
+        if settings["OCR_BACKEND"] not in OCR_BACKENDS:
+            raise ValueError(f"Unknown OCR backend: {settings['OCR_BACKEND']}")
+        for name, choices in cls.SETTING_CHOICES.items():
+            if settings[name] not in choices:
+                raise ValueError(f"Unknown {name.lower().replace('_', ' ')}: {settings[name]}")
+        for name, (low, high) in cls.SETTING_RANGES.items():
+            value = settings[name]
+            if value is None:
+                continue
+            if high is None and value < low:
+                raise ValueError(f"{name} must be at least {low}: {value}")
+            if high is not None and not low <= value <= high:
+                raise ValueError(f"{name} must be between {low} and {high}: {value}")
+        if settings["MIN_AREA"] >= settings["MAX_AREA"] or settings["MIN_AREA_FRACTION"] >= settings["MAX_AREA_FRACTION"]:
+            raise ValueError("Minimum photo areas must be below the maximum ones")
+        if settings["FACE_MIN_RATIO"] >= settings["FACE_MAX_RATIO"]:
+            raise ValueError("FACE_MIN_RATIO must be below FACE_MAX_RATIO")
+        # Band OCR only reads the strip under each photo; a wider search window would silently find nothing more
+        if settings["OCR_MODE"] != "page" and (settings["TEXT_SEARCH_HEIGHT"] > settings["OCR_BAND_HEIGHT"]
+                                               or settings["TEXT_SEARCH_WIDTH_TOLERANCE"] > settings["OCR_BAND_MARGIN"]):
+            raise ValueError("TEXT_SEARCH_HEIGHT and TEXT_SEARCH_WIDTH_TOLERANCE cannot exceed OCR_BAND_HEIGHT and "
+                             "OCR_BAND_MARGIN, the strip that is read; raise those too")
+        return settings
+
+    def cache_stats(self, cancel_event: Optional[threading.Event] = None) -> Dict:
+        stats = self.result_cache.stats() if self.result_cache is not None else {}
+        if self.stage_cache is not None:
+            stats["stages"] = self.stage_cache.stats()
+        return stats
+
+    def load_cascade(self):
+        """Fetch and load the Haar cascade once; all a call that stops before OCR needs."""
+        if self.face_cascade is not None:
+            return
+        with self._load_lock:
+            if self.face_cascade is None:
+                with self.startup_timer.stage("cascade"):
+                    self._ensure_cascade_file()
+                    self.face_cascade = cv2.CascadeClassifier(CASCADE_FILE)
+
+    def load_models(self):
+        """Load the Haar cascade and the OCR_BACKEND engine once."""
+        self.load_cascade()
+        self._ocr(OCR_BACKEND)
+
+    def _ocr(self, name: str) -> OcrBackend:
+        """An OCR engine by OCR_BACKEND name, loaded on first use."""
+        backend = self.ocr_backends[name]
+        if not backend.loaded:
+            with self._load_lock:
+                if not backend.loaded:
+                    backend.load(self.startup_timer)
+        return backend
+
+    def warm_up(self):
+        """Run each model once on a synthetic page so the first request is not cold."""
+        self.load_models()
+        page = np.full((400, 400), 255, dtype=np.uint8)
+        cv2.rectangle(page, (100, 40), (260, 250), 0, -1)
+        cv2.putText(page, "Warm Up", (110, 300), cv2.FONT_HERSHEY_SIMPLEX, 0.8, 0, 2)
+        with self.startup_timer.stage("warm_up"):
+            boxes = self.detect_photo_boxes(page) or [(100, 40, 160, 210)]
+            self.verify_faces(page, boxes)
+            self.read_text_for_boxes(page, boxes)
+
+    @classmethod
+    def shared(cls) -> "ContourProcessingService":
+        """
+        The process's one service, models not necessarily loaded yet (pool
+        factory for calls that stop before OCR, which load only the cascade).
+        """
+        global _shared
+        if _preloaded is not None:
+            return _preloaded
+        with _shared_lock:
+            if _shared is None:
+                _shared = cls()
+            return _shared
+
+    @classmethod
+    def create_loaded(cls) -> "ContourProcessingService":
+        """The ``shared`` service with its models loaded and warmed up (worker pool factory)."""
+        if _preloaded is not None:
+            return _preloaded
+        service = cls.shared()
+        service.load_models()
+        service.warm_up()
+        print("Startup timings (ms): " + ", ".join(f"{k}={v:.0f}" for k, v in service.startup_timings.items()))
+        return service
+
+    @classmethod
+    def preload(cls) -> "ContourProcessingService":
+        """
+        Load the service once before forking workers; ``create_loaded`` in the
+        forked processes then returns this instance instead of loading again.
+        """
+        global _preloaded
+        if _preloaded is None:
+            _preloaded = cls.create_loaded()
+        return _preloaded
     
     def _ensure_cascade_file(self):
         """Ensure the cascade classifier file exists."""
@@ -24,6 +281,13 @@ class ContourProcessingService:
             urllib.request.urlretrieve(CASCADE_URL, CASCADE_FILE)
             print("Download complete.")
 
+    def _cascade(self) -> cv2.CascadeClassifier:
+        """This thread's copy of the face cascade, loaded on its first use."""
+        cascade = getattr(self._thread_cascades, "cascade", None)
+        if cascade is None:
+            cascade = self._thread_cascades.cascade = cv2.CascadeClassifier(CASCADE_FILE)
+        return cascade
+
     def _sanitize_filename(self, name: str) -> str:
         """Clean string for valid filename."""
         name = re.sub(r'[_.:]', ' ', name)
@@ -31,45 +295,153 @@ class ContourProcessingService:
         name = re.sub(r'\s+', ' ', name).strip()
         return name
 
-    def _create_output_folder(self, base_name: str) -> str:
-        """Create and return output folder path."""
-        output_folder = os.path.join(RESULT_DIR, base_name)
-        
-        if not os.path.exists(output_folder):
-            os.makedirs(output_folder)
-            return output_folder
-        
-        counter = 1
-        while True:
-            new_folder = f"{output_folder}({counter})"
-            if not os.path.exists(new_folder):
-                os.makedirs(new_folder)
-                return new_folder
-            counter += 1
-
-    def detect_all_text(self, image_gray: np.ndarray) -> List[Dict]:
-        """Detect text using EasyOCR."""
-        print("Detecting text with EasyOCR...")
-        text_data = self.reader.readtext(image_gray)
-        
-        all_words = []
-        for (bbox, text, conf) in text_data:
-            if conf > EASYOCR_CONFIDENCE_THRESHOLD and text.strip():
+    def _read_words(self, image_gray: np.ndarray, offset: Tuple[int, int] = (0, 0), settings: Optional[Dict] = None) -> List[Dict]:
+        """Run the OCR_BACKEND engine and return confident words in page coordinates."""
+        settings = self.effective_settings(settings)
+        return self._ocr(settings["OCR_BACKEND"]).read(image_gray, offset, settings)
+
+    def detect_all_text(self, image_gray: np.ndarray, settings: Optional[Dict] = None) -> List[Dict]:
+        """Detect text on the whole page."""
+        settings = self.effective_settings(settings)
+        print(f"Detecting text with {settings['OCR_BACKEND']}...")
+        return self._read_words(image_gray, settings=settings)
+
+    def _name_band(self, photo_coords: Tuple[int, int, int, int], image_shape: Tuple[int, ...], settings: Optional[Dict] = None) -> Tuple[int, int, int, int]:
+        """Return the (x0, y0, x1, y1) strip under a photo where its name is printed."""
+        settings = self.effective_settings(settings)
+        x, y, w, h = photo_coords
+        img_h, img_w = image_shape[:2]
+        x0 = max(0, x - settings["OCR_BAND_MARGIN"])
+        x1 = min(img_w, x + w + settings["OCR_BAND_MARGIN"])
+        y0 = min(img_h, y + h)
+        y1 = min(img_h, y + h + settings["OCR_BAND_HEIGHT"])
+        return x0, y0, x1, y1
+
+    def detect_text_in_bands(self, image_gray: np.ndarray, photo_boxes: List[Tuple[int, int, int, int]], settings: Optional[Dict] = None) -> List[List[Dict]]:
+        """Detect text only in the name strip under each photo, one word list per box."""
+        settings = self.effective_settings(settings)
+        print(f"Detecting text with {settings['OCR_BACKEND']} in {len(photo_boxes)} name bands...")
+        bands = [self._name_band(box, image_gray.shape, settings) for box in photo_boxes]
+        return self._ocr(settings["OCR_BACKEND"]).read_bands(image_gray, bands, settings)
+
+    def read_name_fields(self, image_gray: np.ndarray, fields: List[Tuple[int, int, int, int]], settings: Optional[Dict] = None) -> List[List[Dict]]:
+        """Read registered (x0, y0, x1, y1) name fields with the OCR_BACKEND engine, one word list per field."""
+        settings = self.effective_settings(settings)
+        print(f"Detecting text with {settings['OCR_BACKEND']} in {len(fields)} name fields...")
+        return self._ocr(settings["OCR_BACKEND"]).read_bands(image_gray, fields, settings)
+
+    def _text_extent(self, band_gray: np.ndarray,
+                     window: Optional[Tuple[int, int, int, int]] = None) -> Optional[Tuple[int, int, int, int]]:
+        """
+        Return the (x0, y0, x1, y1) box around the first line of ink in a
+        band, or None if blank. Only lines within ``window`` (band
+        coordinates) count, and only the runs of words on that line that
+        overlap it, so a second line or a neighbour's caption does not widen
+        the box.
+        """
+        if band_gray.size == 0 or int(band_gray.max()) - int(band_gray.min()) < self.MIN_BAND_CONTRAST:
+            return None
+        _, ink = cv2.threshold(band_gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+        ink = ink > 0
+        ink[ink.mean(axis=1) > self.RULE_FILL_RATIO, :] = False
+        ink[:, ink.mean(axis=0) > self.RULE_FILL_RATIO] = False
+        wx0, wy0, wx1, wy1 = window if window is not None else (0, 0, ink.shape[1], ink.shape[0])
+        wx0, wy0 = max(0, wx0), max(0, wy0)
+
+        rows = wy0 + np.flatnonzero(ink[wy0:wy1, wx0:wx1].any(axis=1))
+        # Split into lines at gaps wider than LINE_GAP; keep the first one tall enough to be text
+        lines = np.split(rows, np.flatnonzero(np.diff(rows) > self.LINE_GAP + 1) + 1) if rows.size else []
+        line = next((line for line in lines if line[-1] - line[0] + 1 >= self.MIN_LINE_HEIGHT), None)
+        if line is None:
+            return None
+        top, bottom = int(line[0]), int(line[-1]) + 1
+
+        # The line's words may run past the window; a neighbour's caption is further off than word spacing
+        cols = np.flatnonzero(ink[top:bottom].any(axis=0))
+        groups = np.split(cols, np.flatnonzero(np.diff(cols) > (bottom - top) // 2) + 1)
+        groups = [group for group in groups if group[-1] >= wx0 and group[0] < wx1]
+        if not groups:
+            return None
+        return int(groups[0][0]), top, int(groups[-1][-1]) + 1, bottom
+
+    def recognize_text_in_bands(self, image_gray: np.ndarray, photo_boxes: List[Tuple[int, int, int, int]], settings: Optional[Dict] = None) -> List[List[Dict]]:
+        """
+        Read the name strip under each photo with EasyOCR's recognizer only.
+
+        Each strip is cropped to its ink and sent to EasyOCR's ``recognize`` in
+        one batch, skipping CRAFT detection. A strip yields at most one word
+        dict holding the first line of the strip's match window. With
+        ``OCR_RECOGNIZE_FALLBACK`` strips that come back empty, below the
+        confidence threshold or not matching their box are read again with
+        detector + recognizer.
+        """
+        settings = self.effective_settings(settings)
+        easyocr = self._ocr("easyocr")
+        print(f"Recognizing text in {len(photo_boxes)} name bands...")
+        horizontal_list = []
+        owners = []
+        for i, box in enumerate(photo_boxes):
+            x0, y0, x1, y1 = self._name_band(box, image_gray.shape, settings)
+            # The caption under the photo itself, inside the strip words are matched from
+            x, _, w, _ = box
+            window = (x - x0, 1, x + w - x0, settings["TEXT_SEARCH_HEIGHT"] - 1)
+            extent = self._text_extent(image_gray[y0:y1, x0:x1], window)
+            if extent is None:
+                continue
+            ex0, ey0, ex1, ey1 = extent
+            horizontal_list.append([x0 + ex0, x0 + ex1, y0 + ey0, y0 + ey1])
+            owners.append(i)
+
+        band_words = [[] for _ in photo_boxes]
+        if horizontal_list:
+            text_data = easyocr.recognize(image_gray, horizontal_list, OCR_RECOGNIZE_BATCH_SIZE)
+            # EasyOCR sorts its output by position, so map results back by rectangle
+            by_rect = {}
+            for (bbox, text, conf) in text_data:
                 (tl, tr, br, bl) = bbox
-                word = {
-                    'text': text,
-                    'x': int(tl[0]),
-                    'y': int(tl[1]),
-                    'w': int(br[0] - tl[0]),
-                    'h': int(br[1] - tl[1])
-                }
-                all_words.append(word)
-        
-        return all_words
+                by_rect[(int(tl[0]), int(tl[1]), int(br[0]), int(br[1]))] = (text, conf)
+
+            for (x_min, x_max, y_min, y_max), i in zip(horizontal_list, owners):
+                text, conf = by_rect.get((x_min, y_min, x_max, y_max), ("", 0.0))
+                if conf > settings["EASYOCR_CONFIDENCE_THRESHOLD"] and text.strip():
+                    band_words[i] = [{
+                        'text': text,
+                        'x': x_min,
+                        'y': y_min,
+                        'w': x_max - x_min,
+                        'h': y_max - y_min,
+                        'conf': round(float(conf), 4)
+                    }]
+
+        if settings["OCR_RECOGNIZE_FALLBACK"]:
+            # Empty strips, and strips whose line still falls outside the match window
+            matched = self.match_text_to_photos(photo_boxes, band_words, settings)
+            retry = [i for i, (name, _) in enumerate(matched) if not name]
+            if retry:
+                fallback = self.detect_text_in_bands(image_gray, [photo_boxes[i] for i in retry], settings)
+                for i, words in zip(retry, fallback):
+                    band_words[i] = words
 
-    def detect_photo_contours(self, image_gray: np.ndarray) -> List[Tuple[int, int, int, int]]:
+        return band_words
+
+    def read_text_for_boxes(self, image_gray: np.ndarray, photo_boxes: List[Tuple[int, int, int, int]], settings: Optional[Dict] = None) -> List[List[Dict]]:
+        """Run OCR as configured by OCR_MODE and return the candidate words for each box."""
+        settings = self.effective_settings(settings)
+        if not photo_boxes:
+            return []
+        if settings["OCR_MODE"] == "page":
+            all_words = self.detect_all_text(image_gray, settings)
+            return [all_words] * len(photo_boxes)
+        # Tesseract has no separate recognizer; it reads bands as in "band" mode
+        if settings["OCR_MODE"] == "recognize" and settings["OCR_BACKEND"] == "easyocr":
+            return self.recognize_text_in_bands(image_gray, photo_boxes, settings)
+        return self.detect_text_in_bands(image_gray, photo_boxes, settings)
+
+    def detect_photo_contours(self, image_gray: np.ndarray, settings: Optional[Dict] = None,
+                              blur_size: int = 5) -> List[Tuple[int, int, int, int]]:
         """Detect potential photo contours."""
-        blurred = cv2.GaussianBlur(image_gray, (5, 5), 0)
+        settings = self.effective_settings(settings)
+        blurred = cv2.GaussianBlur(image_gray, (blur_size, blur_size), 0)
         _, img_thresh = cv2.threshold(blurred, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
         contours, _ = cv2.findContours(img_thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
         
@@ -79,89 +451,508 @@ class ContourProcessingService:
             area = w * h
             aspect_ratio = float(w) / h
             
-            if MIN_AREA < area < MAX_AREA and MIN_ASPECT_RATIO < aspect_ratio < MAX_ASPECT_RATIO:
+            if (settings["MIN_AREA"] < area < settings["MAX_AREA"]
+                    and settings["MIN_ASPECT_RATIO"] < aspect_ratio < settings["MAX_ASPECT_RATIO"]):
                 detected_boxes.append((x, y, w, h))
                 
         return sorted(detected_boxes, key=lambda b: (b[1], b[0]))
 
-    def match_text_to_photo(self, photo_coords: Tuple[int, int, int, int], all_words: List[Dict]) -> Tuple[Optional[str], Optional[Dict]]:
-        """Match text to photo based on spatial relationship."""
+    def detect_photo_components(self, image_gray: np.ndarray, settings: Optional[Dict] = None,
+                                blur_size: int = 5) -> List[Tuple[int, int, int, int]]:
+        """Detect potential photo regions with connected components and vectorized filtering."""
+        settings = self.effective_settings(settings)
+        blurred = cv2.GaussianBlur(image_gray, (blur_size, blur_size), 0)
+        _, img_thresh = cv2.threshold(blurred, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+        _, _, stats, _ = cv2.connectedComponentsWithStats(img_thresh, connectivity=8)
+
+        # Row 0 is the background
+        boxes = stats[1:, :4].astype(np.int64)
+        w = boxes[:, 2]
+        h = boxes[:, 3]
+        area = w * h
+        aspect_ratio = w / h
+        keep = (
+            (settings["MIN_AREA"] < area) & (area < settings["MAX_AREA"])
+            & (settings["MIN_ASPECT_RATIO"] < aspect_ratio) & (aspect_ratio < settings["MAX_ASPECT_RATIO"])
+        )
+        boxes = boxes[keep]
+        boxes = boxes[np.lexsort((boxes[:, 0], boxes[:, 1]))]
+        return [tuple(int(v) for v in box) for box in boxes]
+
+    def detect_photo_boxes(self, image_gray: np.ndarray, settings: Optional[Dict] = None) -> List[Tuple[int, int, int, int]]:
+        """Detect potential photos with the detector chosen by PHOTO_DETECTOR, at DETECTION_RESOLUTION."""
+        settings = self.effective_settings(settings)
+        detect = self.detect_photo_components if settings["PHOTO_DETECTOR"] == "components" else self.detect_photo_contours
+        if settings["DETECTION_RESOLUTION"] == "normalized":
+            return self._detect_normalized(image_gray, settings, detect)
+        return detect(image_gray, settings)
+
+    def _detect_normalized(self, image_gray: np.ndarray, settings: Dict, detect) -> List[Tuple[int, int, int, int]]:
+        """
+        Run ``detect`` on the page downscaled to DETECTION_MAX_SIDE, with the
+        area limits taken from the *_AREA_FRACTION settings, and scale the
+        boxes back to full-resolution coordinates. The blur shrinks with the
+        page so light photo edges are not smeared into the background.
+        """
+        height, width = image_gray.shape[:2]
+        scale = min(1.0, settings["DETECTION_MAX_SIDE"] / max(height, width))
+        small = image_gray
+        if scale < 1.0:
+            small = cv2.resize(image_gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        small_area = small.shape[0] * small.shape[1]
+        # Whole pixels, as MIN_AREA/MAX_AREA are: the limits are strict, so rounding outward keeps every box
+        boxes = detect(small, dict(settings,
+                                   MIN_AREA=int(np.floor(settings["MIN_AREA_FRACTION"] * small_area)),
+                                   MAX_AREA=int(np.ceil(settings["MAX_AREA_FRACTION"] * small_area))),
+                       blur_size=self.NORMALIZED_BLUR_SIZE if scale < 1.0 else 5)
+        if scale == 1.0:
+            return boxes
+
+        # Outward rounding: a box edge is only known to within one small pixel
+        fx = width / small.shape[1]
+        fy = height / small.shape[0]
+        full_boxes = []
+        for x, y, w, h in boxes:
+            x0 = int(x * fx)
+            y0 = int(y * fy)
+            x1 = min(width, int(np.ceil((x + w) * fx)))
+            y1 = min(height, int(np.ceil((y + h) * fy)))
+            full_boxes.append((x0, y0, x1 - x0, y1 - y0))
+        return full_boxes
+
+    def _faces_on_page(self, image_gray: np.ndarray, photo_boxes: List[Tuple[int, int, int, int]], settings: Dict) -> List[bool]:
+        """Run the cascade once on a downscaled page and assign faces to boxes by containment."""
+        scale = min(1.0, settings["FACE_PAGE_MAX_SIDE"] / max(image_gray.shape[:2]))
+        small = image_gray
+        if scale < 1.0:
+            small = cv2.resize(image_gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+        widths = [w for (_, _, w, _) in photo_boxes]
+        min_side = max(24, int(min(widths) * settings["FACE_MIN_RATIO"] * scale))
+        max_side = max(min_side + 1, int(max(widths) * settings["FACE_MAX_RATIO"] * scale))
+        faces = self._cascade().detectMultiScale(
+            small, scaleFactor=1.1, minNeighbors=5,
+            minSize=(min_side, min_side), maxSize=(max_side, max_side)
+        )
+        if len(faces) == 0:
+            return [False] * len(photo_boxes)
+
+        faces = np.asarray(faces, dtype=np.float64) / scale
+        face_cx = faces[:, 0] + faces[:, 2] / 2
+        face_cy = faces[:, 1] + faces[:, 3] / 2
+        boxes = np.asarray(photo_boxes, dtype=np.float64)
+        x, y, w, h = (boxes[:, i:i + 1] for i in range(4))
+        inside = (face_cx > x) & (face_cx < x + w) & (face_cy > y) & (face_cy < y + h)
+        return inside.any(axis=1).tolist()
+
+    def _face_in_crop(self, image_gray: np.ndarray, photo_coords: Tuple[int, int, int, int], settings: Dict) -> bool:
+        """Look for a face in one downscaled crop, trying large faces first and stopping at the first hit."""
         x, y, w, h = photo_coords
-        photo_bottom = y + h
-        
-        candidate_words = []
-        search_y_max = photo_bottom + TEXT_SEARCH_HEIGHT
-        search_x_min = x - TEXT_SEARCH_WIDTH_TOLERANCE
-        search_x_max = x + w + TEXT_SEARCH_WIDTH_TOLERANCE
-
-        for word in all_words:
-            word_center_x = word['x'] + word['w'] / 2
-            is_below = word['y'] > photo_bottom and (word['y'] + word['h']) < search_y_max
-            is_aligned = word_center_x > search_x_min and word_center_x < search_x_max
-            
-            if is_below and is_aligned:
-                candidate_words.append(word)
-        
+        crop = image_gray[y:y+h, x:x+w]
+        scale = min(1.0, settings["FACE_CROP_WIDTH"] / w)
+        if scale < 1.0:
+            crop = cv2.resize(crop, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+        min_side = max(24, int(w * settings["FACE_MIN_RATIO"] * scale))
+        max_side = max(min_side + 1, int(w * settings["FACE_MAX_RATIO"] * scale))
+        # Portrait photos are mostly face, so the coarse large-face pass usually decides
+        split = max(min_side, int(w * self.LARGE_FACE_RATIO * scale))
+        for lo, hi in ((split, max_side), (min_side, split)):
+            if hi <= lo:
+                continue
+            faces = self._cascade().detectMultiScale(
+                crop, scaleFactor=1.1, minNeighbors=5, minSize=(lo, lo), maxSize=(hi, hi)
+            )
+            if len(faces) > 0:
+                return True
+        return False
+
+    def verify_faces(self, image_gray: np.ndarray, photo_boxes: List[Tuple[int, int, int, int]], settings: Optional[Dict] = None) -> List[bool]:
+        """Return, for each box, whether it contains a face (strategy from FACE_CHECK_MODE)."""
+        settings = self.effective_settings(settings)
+        if not photo_boxes:
+            return []
+        if settings["FACE_CHECK_MODE"] == "page":
+            return self._faces_on_page(image_gray, photo_boxes, settings)
+        if settings["FACE_CHECK_MODE"] == "crop":
+            return [self._face_in_crop(image_gray, box, settings) for box in photo_boxes]
+
+        has_face = []
+        for (x, y, w, h) in photo_boxes:
+            faces = self._cascade().detectMultiScale(image_gray[y:y+h, x:x+w], scaleFactor=1.1, minNeighbors=5, minSize=(30, 30))
+            has_face.append(len(faces) > 0)
+        return has_face
+
+    def _name_from_words(self, candidate_words: List[Dict]) -> Tuple[Optional[str], Optional[Dict]]:
+        """Join matched words (already sorted left to right) into a clean name."""
         if not candidate_words:
             return None, None
 
-        candidate_words.sort(key=lambda w: w['x'])
         raw_full_name = " ".join([w['text'] for w in candidate_words])
         clean_full_name = self._sanitize_filename(raw_full_name)
         
         return clean_full_name, {"full_name": clean_full_name, "words": candidate_words}
 
-    async def process_image(self, image_path: str, output_base_name: str) -> Dict:
-        """Process an image and extract photos with text."""
-        if not os.path.exists(image_path):
-            raise FileNotFoundError(f"Image file not found: {image_path}")
+    def match_text_to_photo(self, photo_coords: Tuple[int, int, int, int], all_words: List[Dict], settings: Optional[Dict] = None) -> Tuple[Optional[str], Optional[Dict]]:
+        """Match text to photo based on spatial relationship."""
+        return self.match_text_to_photos([photo_coords], [all_words], settings)[0]
 
-        # Create output directory
-        output_folder = self._create_output_folder(output_base_name)
-        
-        # Read and process image
-        image = cv2.imread(image_path)
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    def match_text_to_photos(self, photo_boxes: List[Tuple[int, int, int, int]], box_words: List[List[Dict]], settings: Optional[Dict] = None) -> List[Tuple[Optional[str], Optional[Dict]]]:
+        """Match every box to its name; boxes sharing one word list are matched in one pass."""
+        settings = self.effective_settings(settings)
+        matches = [(None, None)] * len(photo_boxes)
+        groups = {}
+        for i, words in enumerate(box_words):
+            groups.setdefault(id(words), (words, []))[1].append(i)
+
+        for words, indices in groups.values():
+            candidates = WordTable(words).match(
+                [photo_boxes[i] for i in indices],
+                search_height=settings["TEXT_SEARCH_HEIGHT"],
+                width_tolerance=settings["TEXT_SEARCH_WIDTH_TOLERANCE"],
+            )
+            for i, candidate_words in zip(indices, candidates):
+                matches[i] = self._name_from_words(candidate_words)
+        return matches
+
+    def _stage(self, stage: str, image_hash: Optional[str], settings: Dict, inputs, compute,
+               extra_settings: Sequence[str] = ()):
+        """
+        Return a stage's output from the stage cache, computing and storing it
+        on a miss. ``extra_settings`` are keyed on top of STAGE_SETTINGS.
+        """
+        if self.stage_cache is None or image_hash is None:
+            return compute()
+        params = {name: settings[name] for name in self.STAGE_SETTINGS[stage] + tuple(extra_settings)}
+        params["inputs"] = inputs
+        value = self.stage_cache.get(image_hash, stage, params)
+        if value is None:
+            value = compute()
+            self.stage_cache.put(image_hash, stage, params, value)
+        return value
+
+    def process_image(self, image: Union[Upload, str, np.ndarray], output_base_name: str,
+                      cancel_event: Optional[threading.Event] = None, overrides: Optional[Dict] = None,
+                      progress: Optional[Callable[[str], None]] = None, profile: Sequence[str] = ()) -> Dict:
+        """Process an image and extract photos with text.
+
+        ``image`` is an upload body from ``read_upload``, an image path or a
+        BGR array. ``overrides`` replaces settings from RESULT_SETTINGS for
+        this call only. Blocking; run it through ``ProcessingPool`` from async
+        code. When ``cancel_event`` is set the call stops at the next stage
+        boundary. ``progress`` is called with each stage name as it starts.
+        ``profile`` ("cpu", "memory") runs the call uncached under the
+        profilers; see ``_profiled``. The ``PIPELINE_DEPTH`` setting stops
+        the call after that stage (``PIPELINE_DEPTHS``).
+        """
+        settings = self.effective_settings(overrides)
+        image_hash = None
+        if self.result_cache is not None or self.stage_cache is not None:
+            image_hash = content_hash(image)
+
+        def load_page():
+            page = decode_image(image)
+            # Arrays (document pages) have no encoded bytes to keep, so they cannot be reprocessed;
+            # quick box and face checks keep no copy either
+            if (self.stage_cache is not None and image_hash and not profile and not isinstance(image, np.ndarray)
+                    and settings["PIPELINE_DEPTH"] not in SHALLOW_DEPTHS):
+                self.stage_cache.put_source(image_hash, image)
+            return page
+
+        if profile:
+            return self._profiled(profile, image_hash, load_page, output_base_name, settings, cancel_event, progress)
+        return self._process(image_hash, load_page, output_base_name, settings, cancel_event, progress)
+
+    def _profiled(self, modes: Sequence[str], image_hash: Optional[str], load_page, output_base_name: str,
+                  settings: Dict, cancel_event: Optional[threading.Event],
+                  progress: Optional[Callable[[str], None]]) -> Dict:
+        """
+        Run the pipeline under ``RequestProfiler`` with the caches bypassed, so
+        every stage really runs. The raw profile and allocation snapshot are
+        written into the run folder (a separate ``<name>_profile`` run when
+        nothing goes to disk) and summarized under ``profile``.
+        """
+        with RequestProfiler(modes) as profiler:
+            result = self._process(image_hash, load_page, output_base_name, settings, cancel_event, progress,
+                                   use_caches=False)
+        folder = result["output_folder"]
+        separate = folder is None
+        if separate:
+            _, folder = self.run_store.allocate(f"{output_base_name}_profile")
+        summary = profiler.summary(result.get("memory_peaks"))
+        summary["artifacts"], size = profiler.dump(folder)
+        # The output run was already recorded by _write_output; a second line would count it twice
+        if separate:
+            self.run_store.record(folder, size)
+        return dict(result, profile=summary)
+
+    def process_document_page(self, document: Upload, page_index: int, output_base_name: str,
+                              dpi: int = DOCUMENT_RASTER_DPI, cancel_event: Optional[threading.Event] = None,
+                              overrides: Optional[Dict] = None,
+                              progress: Optional[Callable[[str], None]] = None) -> Dict:
+        """Rasterize one page of a PDF/TIFF upload and process it like a single image."""
+        if progress is not None:
+            progress("rasterize")
+        timer = StageTimer()
+        with timer.stage("rasterize"):
+            page = load_page(document, page_index, dpi)
+        result = self.process_image(page, output_base_name, cancel_event=cancel_event, overrides=overrides,
+                                    progress=progress)
+        result["timings"] = {**timer.durations, **result["timings"]}
+        return dict(result, page=page_index + 1)
+
+    def reprocess(self, image_hash: str, output_base_name: str,
+                  overrides: Optional[Dict] = None, cancel_event: Optional[threading.Event] = None,
+                  progress: Optional[Callable[[str], None]] = None) -> Dict:
+        """
+        Re-run the pipeline on an earlier upload, identified by its ``image_hash``.
+
+        Only the stages whose settings (or upstream results) changed are
+        recomputed; e.g. new TEXT_SEARCH_* values reuse the stored boxes, face
+        checks and OCR words and only redo matching and output.
+        """
+        if self.stage_cache is None:
+            raise LookupError("Stage cache is disabled")
+        if not re.fullmatch(r"[0-9a-f]{64}", image_hash):
+            raise LookupError(f"No cached page for {image_hash}")
+        settings = self.effective_settings(overrides)
+
+        def load_page():
+            path = self.stage_cache.get_source(image_hash)
+            try:
+                if path is not None:
+                    return decode_image(path)
+            except FileNotFoundError:
+                pass  # evicted since the lookup
+            raise LookupError(f"No cached page for {image_hash}")
+
+        return self._process(image_hash, load_page, output_base_name, settings, cancel_event, progress)
+
+    def register_layout(self, image: Union[Upload, str, np.ndarray], name: str,
+                        slots: Optional[List[Tuple[int, int, int, int]]] = None,
+                        fields: Optional[List[Tuple[int, int, int, int]]] = None,
+                        overrides: Optional[Dict] = None, cancel_event: Optional[threading.Event] = None) -> Dict:
+        """
+        Register ``image`` (a blank or filled copy of a form) as layout ``name``.
+
+        ``slots`` are the (x, y, w, h) photo slots and ``fields`` the (x0, y0,
+        x1, y1) name fields, in the image's pixels. Without slots, the photo
+        boxes detected on the image are used (no face check, so a blank form
+        works); without fields, each slot's name band is.
+        """
+        settings = self.effective_settings(overrides)
+        check_cancelled(cancel_event)
+        gray = cv2.cvtColor(decode_image(image), cv2.COLOR_BGR2GRAY)
+        if slots is None:
+            slots = self.detect_photo_boxes(gray, settings)
+        if fields is None:
+            fields = [self._name_band(slot, gray.shape, settings) for slot in slots]
+        layout = self.layouts.register(name, gray, slots, fields)
+        print(f"Registered layout {name} with {len(layout.slots)} photo slots")
+        return layout.describe()
+
+    def _process(self, image_hash: Optional[str], load_page, output_base_name: str,
+                 settings: Dict, cancel_event: Optional[threading.Event],
+                 progress: Optional[Callable[[str], None]] = None, use_caches: bool = True) -> Dict:
+        timer = StageTimer()
+        # Stage cache lookups are keyed by this; None computes every stage
+        stage_hash = image_hash if use_caches else None
+
+        @contextmanager
+        def stage(name: str):
+            check_cancelled(cancel_event)
+            if progress is not None:
+                progress(name)
+            with timer.stage(name):
+                yield
+
+        # Same bytes under the same settings: return the stored result
+        cache_key = None
+        if self.result_cache is not None and stage_hash is not None:
+            with timer.stage("cache"):
+                # Registering or removing a layout can change the result
+                key_settings = dict(settings, LAYOUTS=self.layouts.version) if settings["LAYOUT_MATCHING"] else settings
+                cache_key = ResultCache.make_key(image_hash, key_settings)
+                cached = self.result_cache.get(cache_key)
+            if cached is not None:
+                return dict(cached, cached=True, timings=dict(timer.durations))
+
+        depth = settings["PIPELINE_DEPTH"]
 
-        # Detect text and photos
-        all_words = self.detect_all_text(gray)
-        photo_boxes = self.detect_photo_contours(gray)
+        def respond(result: Dict) -> Dict:
+            result["depth"] = depth
+            result["layout"] = layout["name"] if layout is not None else None
+            # Inline crops would bloat the cache; they are cheap to re-encode
+            if cache_key is not None and not (depth == "crops" and settings["OUTPUT_MODE"] == "inline"):
+                self.result_cache.put(cache_key, result)
+            # Timings describe this call, so they are not part of the cached result
+            response = dict(result, timings=dict(timer.durations))
+            if timer.peaks:
+                response["memory_peaks"] = dict(timer.peaks)
+            return response
+
+        # Decode and process image
+        with stage("decode"):
+            image = load_page()
+            gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+        # A registered form's slots and name fields are known: no contour search, no matching window
+        layout = None
+        # Nothing registered: nothing to match, and no stage output worth storing
+        if settings["LAYOUT_MATCHING"] and self.layouts.layouts():
+            with stage("layout"):
+                layout = self._stage("layout", stage_hash, settings, self.layouts.version,
+                                     lambda: {"match": self.layouts.match(gray, settings["LAYOUT_MATCH_THRESHOLD"])})["match"]
+
+        # Find photo candidates and keep the ones with a face
+        with stage("boxes"):
+            if layout is not None:
+                photo_boxes = layout["slots"]
+            else:
+                photo_boxes = self._stage("boxes", stage_hash, settings, None,
+                                          lambda: self.detect_photo_boxes(gray, settings))
+            photo_boxes = [tuple(box) for box in photo_boxes]
+        if depth == "boxes":
+            return respond(self._box_result(image_hash, photo_boxes))
+
+        # Boxes alone need no models, faces only the cascade
+        self.load_cascade()
+        with stage("faces"):
+            # Empty slots of a registered form are dropped here like any other box without a face
+            has_face = self._stage("faces", stage_hash, settings, photo_boxes,
+                                   lambda: self.verify_faces(gray, photo_boxes, settings))
+            confirmed = [i for i, ok in enumerate(has_face) if ok]
+            confirmed_boxes = [photo_boxes[i] for i in confirmed]
+        if depth == "faces":
+            return respond(self._box_result(image_hash, confirmed_boxes))
+
+        self.load_models()
+
+        # OCR only where a confirmed photo's name can be; skip it for pages without photos
+        with stage("ocr"):
+            if not confirmed_boxes:
+                box_words = []
+                total_words = 0
+            elif layout is not None:
+                fields = [tuple(layout["fields"][i]) for i in confirmed]
+                box_words = self._stage("ocr", stage_hash, settings, {"fields": fields},
+                                        lambda: self.read_name_fields(gray, fields, settings))
+                total_words = sum(len(words) for words in box_words)
+            elif settings["OCR_MODE"] == "page":
+                # Page words do not depend on the boxes, so they are cached once per page
+                all_words = self._stage("ocr", stage_hash, settings, None,
+                                        lambda: self.detect_all_text(gray, settings))
+                box_words = [all_words] * len(confirmed_boxes)
+                total_words = len(all_words)
+            else:
+                recognize = settings["OCR_MODE"] == "recognize" and settings["OCR_BACKEND"] == "easyocr"
+                box_words = self._stage("ocr", stage_hash, settings, confirmed_boxes,
+                                        lambda: self.read_text_for_boxes(gray, confirmed_boxes, settings),
+                                        self.RECOGNIZE_STAGE_SETTINGS if recognize else ())
+                total_words = sum(len(words) for words in box_words)
+
+        with stage("match"):
+            if layout is not None:
+                # Every word read in a slot's name field is its name
+                matches = [self._name_from_words(sorted(words, key=lambda word: word['x'])) for words in box_words]
+            else:
+                matches = self.match_text_to_photos(confirmed_boxes, box_words, settings)
+
+        if depth == "names":
+            # Names, boxes and words as with OUTPUT_MODE "none": no crop is encoded or written
+            result = self._write_output(image, image_hash, confirmed_boxes, matches, output_base_name,
+                                        dict(settings, OUTPUT_MODE="none"))
+        else:
+            with stage("output"):
+                result = self._write_output(image, image_hash, confirmed_boxes, matches, output_base_name, settings)
+        result["total_words"] = total_words
+        return respond(result)
+
+    @staticmethod
+    def _box_result(image_hash: Optional[str], boxes: List[Tuple[int, int, int, int]]) -> Dict:
+        """Result of a call stopped before OCR: the boxes, nothing written."""
+        return {
+            "success": True,
+            "run_id": None,
+            "output_folder": None,
+            "manifest_path": None,
+            "total_processed": len(boxes),
+            "image_hash": image_hash,
+            "results": [{"bbox": {"x": x, "y": y, "w": w, "h": h}} for x, y, w, h in boxes],
+        }
+
+    def _write_output(self, image: np.ndarray, image_hash: Optional[str], confirmed_boxes: List[Tuple[int, int, int, int]],
+                      matches: List[Tuple[Optional[str], Optional[Dict]]], output_base_name: str,
+                      settings: Dict) -> Dict:
+        """Save (or inline) each confirmed photo and build the result dict."""
+        output_mode = settings["OUTPUT_MODE"]
+        run_id, output_folder = self.run_store.allocate(output_base_name) if output_mode == "disk" else (None, None)
+        extension = FORMATS[settings["OUTPUT_FORMAT"]][0]
 
         results = []
-        count_saved = 0
-        
-        # Process each detected photo
-        for i, (x, y, w, h) in enumerate(photo_boxes):
+        writes = []
+        inline = []
+        manifest = []
+        used_names = set()
+
+        # Save each confirmed photo; encoding and writing run on the writer pool
+        for index, ((x, y, w, h), (nama, bounding_box_data)) in enumerate(zip(confirmed_boxes, matches)):
             crop_foto = image[y:y+h, x:x+w]
-            faces = self.face_cascade.detectMultiScale(crop_foto, scaleFactor=1.1, minNeighbors=5, minSize=(30, 30))
-            
-            if len(faces) > 0:
-                nama, bounding_box_data = self.match_text_to_photo((x, y, w, h), all_words)
-                filename_base = nama if nama else f"tanpa_nama_{count_saved}"
+            item = {"name": nama, "bbox": {"x": x, "y": y, "w": w, "h": h}}
 
-                # Save results
-                image_filename = f"{filename_base}.png"
-                json_filename = f"{filename_base}.json"
-                
-                image_path = os.path.join(output_folder, image_filename)
-                json_path = os.path.join(output_folder, json_filename)
-                
-                cv2.imwrite(image_path, crop_foto)
-                if bounding_box_data:
-                    with open(json_path, 'w') as f:
-                        json.dump(bounding_box_data, f, indent=4)
-                
-                results.append({
+            if output_mode == "disk":
+                filename_base = nama if nama else f"tanpa_nama_{index}"
+                # Two people read with the same name must not overwrite each other
+                suffix = 1
+                while filename_base.lower() in used_names:
+                    suffix += 1
+                    filename_base = f"{nama}_{suffix}"
+                used_names.add(filename_base.lower())
+
+                image_path = os.path.join(output_folder, f"{filename_base}{extension}")
+                writes.append(self.crop_writer.save_crop(image_path, crop_foto, settings))
+                json_path = None
+                if bounding_box_data and settings["OUTPUT_LEGACY_SIDECARS"]:
+                    json_path = os.path.join(output_folder, f"{filename_base}.json")
+                    writes.append(self.crop_writer.save_json(json_path, legacy_sidecar(bounding_box_data)))
+                manifest.append({
                     "name": nama,
+                    "bbox": item["bbox"],
                     "image_path": image_path,
-                    "json_path": json_path if bounding_box_data else None,
-                    "bbox": {"x": x, "y": y, "w": w, "h": h}
+                    "words": bounding_box_data["words"] if bounding_box_data else [],
                 })
-                count_saved += 1
+                item = {
+                    "name": nama,
+                    "image_path": image_path,
+                    "json_path": json_path,
+                    "bbox": item["bbox"],
+                }
+            else:
+                item["image_path"] = None
+                item["words"] = bounding_box_data["words"] if bounding_box_data else []
+                if output_mode == "inline":
+                    inline.append((item, self.crop_writer.inline_crop(crop_foto, settings)))
+            results.append(item)
+
+        manifest_path = None
+        if output_folder is not None:
+            manifest_path = os.path.join(output_folder, MANIFEST_NAME)
+            writes.append(self.crop_writer.save_manifest(manifest_path, manifest))
+
+        # Paths in the response exist once it is returned
+        written = sum(future.result() for future in writes)
+        if output_folder is not None:
+            self.run_store.record(output_folder, written)
+        for item, future in inline:
+            mime_type, data = future.result()
+            item["image"] = {"mime_type": mime_type, "data": data}
 
         return {
             "success": True,
+            "run_id": run_id,
             "output_folder": output_folder,
-            "total_processed": count_saved,
+            "manifest_path": manifest_path,
+            "total_processed": len(results),
+            "image_hash": image_hash,
             "results": results
-        }
\ No newline at end of file
+        }
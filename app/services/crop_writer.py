@@ -0,0 +1,117 @@
+import base64
+import json
+import os
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+import cv2
+import numpy as np
+from ..config import *
+
+OUTPUT_MODES = ("disk", "inline", "none")
+MANIFEST_NAME = "manifest.jsonl"
+
+# Extension and MIME type per output format
+FORMATS = {
+    "png": (".png", "image/png"),
+    "jpeg": (".jpg", "image/jpeg"),
+    "webp": (".webp", "image/webp"),
+}
+
+
+def encode_params(settings: Dict) -> List[int]:
+    output_format = settings["OUTPUT_FORMAT"]
+    if output_format == "png":
+        level = settings["OUTPUT_PNG_COMPRESSION"]
+        # No explicit level keeps OpenCV's default: level 1 with the RLE strategy
+        return [] if level is None else [cv2.IMWRITE_PNG_COMPRESSION, level]
+    if output_format == "jpeg":
+        return [cv2.IMWRITE_JPEG_QUALITY, settings["OUTPUT_JPEG_QUALITY"]]
+    if output_format == "webp":
+        return [cv2.IMWRITE_WEBP_QUALITY, settings["OUTPUT_WEBP_QUALITY"]]
+    raise ValueError(f"Unknown output format: {output_format}")
+
+
+def encode_crop(crop: np.ndarray, settings: Dict) -> bytes:
+    ok, data = cv2.imencode(FORMATS[settings["OUTPUT_FORMAT"]][0], crop, encode_params(settings))
+    if not ok:
+        raise RuntimeError(f"Could not encode crop as {settings['OUTPUT_FORMAT']}")
+    return data.tobytes()
+
+
+def legacy_sidecar(bounding_box_data: Dict) -> Dict:
+    """The per-name JSON of earlier versions: name and word boxes, no confidences."""
+    return {
+        "full_name": bounding_box_data["full_name"],
+        "words": [{k: v for k, v in word.items() if k != "conf"} for word in bounding_box_data["words"]],
+    }
+
+
+class CropWriter:
+    """
+    Encodes and writes crops (and the run manifest) on a small thread pool.
+
+    OpenCV releases the GIL while encoding, so a page's crops are encoded in
+    parallel. Callers wait on the returned futures before reporting paths;
+    write futures resolve to the number of bytes written.
+    With ``threads=0`` everything runs in the calling thread.
+    """
+
+    def __init__(self, threads: int = OUTPUT_WRITER_THREADS):
+        self.threads = threads
+        # Built up front (its threads still start on demand): the service is shared by
+        # the request threads, and a lazily created executor could be created twice
+        self._executor: Optional[ThreadPoolExecutor] = (
+            ThreadPoolExecutor(max_workers=threads, thread_name_prefix="writer") if threads > 0 else None
+        )
+
+    def _submit(self, fn, *args) -> Future:
+        if self.threads <= 0:
+            future = Future()
+            try:
+                future.set_result(fn(*args))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+        return self._executor.submit(fn, *args)
+
+    @staticmethod
+    def _write_crop(path: str, crop: np.ndarray, settings: Dict) -> int:
+        with open(path, "wb") as f:
+            return f.write(encode_crop(crop, settings))
+
+    @staticmethod
+    def _write_json(path: str, data: Dict) -> int:
+        with open(path, "w") as f:
+            json.dump(data, f, indent=4)
+            return f.tell()
+
+    @staticmethod
+    def _write_manifest(path: str, entries: List[Dict]) -> int:
+        # One write and one fsync for the whole run
+        data = "".join(json.dumps(entry, ensure_ascii=False) + "\n" for entry in entries).encode("utf-8")
+        with open(path, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        return len(data)
+
+    @staticmethod
+    def _inline_crop(crop: np.ndarray, settings: Dict) -> Tuple[str, str]:
+        return FORMATS[settings["OUTPUT_FORMAT"]][1], base64.b64encode(encode_crop(crop, settings)).decode("ascii")
+
+    def save_crop(self, path: str, crop: np.ndarray, settings: Dict) -> Future:
+        return self._submit(self._write_crop, path, crop, settings)
+
+    def save_json(self, path: str, data: Dict) -> Future:
+        return self._submit(self._write_json, path, data)
+
+    def save_manifest(self, path: str, entries: List[Dict]) -> Future:
+        return self._submit(self._write_manifest, path, entries)
+
+    def inline_crop(self, crop: np.ndarray, settings: Dict) -> Future:
+        """Future of ``(mime type, base64 data)`` for a crop returned in the response."""
+        return self._submit(self._inline_crop, crop, settings)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
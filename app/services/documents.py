@@ -0,0 +1,124 @@
+import io
+import threading
+from typing import Union
+import cv2
+import numpy as np
+from ..config import *
+from .image_io import Upload, SpooledUpload, ImageTooLargeError, InvalidImageError
+
+PDF_MAGIC = b"%PDF"
+TIFF_MAGICS = (b"II*\x00", b"MM\x00*", b"II+\x00", b"MM\x00+")
+
+# PDFium is not thread-safe, even across documents: every pypdfium2 call
+# (including closing its objects) happens under this lock
+_pdfium_lock = threading.Lock()
+
+
+def _head(upload: Upload, size: int = 8) -> bytes:
+    if isinstance(upload, SpooledUpload):
+        with open(upload.path, "rb") as f:
+            return f.read(size)
+    return bytes(upload[:size])
+
+
+def _source(upload: Upload) -> Union[str, bytes]:
+    return upload.path if isinstance(upload, SpooledUpload) else upload
+
+
+def _tiff_source(upload: Upload):
+    return upload.path if isinstance(upload, SpooledUpload) else io.BytesIO(upload)
+
+
+def document_kind(upload: Upload) -> str:
+    """Return "pdf", "tiff" or "image" from the upload's magic bytes."""
+    head = _head(upload)
+    if head.startswith(PDF_MAGIC):
+        return "pdf"
+    if head[:4] in TIFF_MAGICS:
+        return "tiff"
+    return "image"
+
+
+def is_document(upload: Upload) -> bool:
+    """A PDF or TIFF, read page by page with ``load_page`` (it may still have one page)."""
+    return document_kind(upload) in ("pdf", "tiff")
+
+
+def page_count(upload: Upload) -> int:
+    """Number of pages, read without rasterizing any of them."""
+    kind = document_kind(upload)
+    try:
+        if kind == "pdf":
+            import pypdfium2
+
+            with _pdfium_lock:
+                pdf = pypdfium2.PdfDocument(_source(upload))
+                try:
+                    return len(pdf)
+                finally:
+                    pdf.close()
+        if kind == "tiff":
+            import tifffile
+
+            with tifffile.TiffFile(_tiff_source(upload)) as tif:
+                return len(tif.pages)
+    except Exception as e:
+        raise InvalidImageError(f"Unreadable {kind.upper()} document: {e}")
+    return 1
+
+
+def _to_bgr(pixels: np.ndarray) -> np.ndarray:
+    """Convert a TIFF page (gray, RGB or RGBA, any integer depth) to 8-bit BGR."""
+    if pixels.dtype != np.uint8:
+        pixels = cv2.normalize(pixels, None, 0, 255, cv2.NORM_MINMAX).astype(np.uint8)
+    if pixels.ndim == 2:
+        return cv2.cvtColor(pixels, cv2.COLOR_GRAY2BGR)
+    if pixels.shape[2] == 4:
+        return cv2.cvtColor(pixels, cv2.COLOR_RGBA2BGR)
+    return cv2.cvtColor(pixels, cv2.COLOR_RGB2BGR)
+
+
+def load_page(upload: Upload, index: int, dpi: int = DOCUMENT_RASTER_DPI,
+              max_pixels: int = MAX_IMAGE_PIXELS) -> np.ndarray:
+    """
+    Rasterize a single page of a PDF (at ``dpi``) or TIFF to a BGR array.
+
+    Only the requested page is decoded, so callers holding one page per
+    worker keep memory flat regardless of document length. The pixel limit
+    is checked from the page size before rendering.
+    """
+    kind = document_kind(upload)
+    if kind == "pdf":
+        import pypdfium2
+
+        with _pdfium_lock:
+            pdf = pypdfium2.PdfDocument(_source(upload))
+            try:
+                page = pdf[index]
+                try:
+                    scale = dpi / 72
+                    width, height = page.get_size()
+                    if width * scale * height * scale > max_pixels:
+                        raise ImageTooLargeError(f"Page {index + 1} at {dpi} dpi exceeds {max_pixels} pixels")
+                    bitmap = page.render(scale=scale)
+                    try:
+                        # pdfium renders BGR, which is what OpenCV expects; copy out of its buffer
+                        return np.array(bitmap.to_numpy(), copy=True)
+                    finally:
+                        bitmap.close()
+                finally:
+                    page.close()
+            finally:
+                pdf.close()
+
+    if kind == "tiff":
+        import tifffile
+
+        with tifffile.TiffFile(_tiff_source(upload)) as tif:
+            page = tif.pages[index]
+            height, width = page.shape[:2]
+            if width * height > max_pixels:
+                raise ImageTooLargeError(f"Page {index + 1} is {width}x{height}, more than {max_pixels} pixels")
+            return _to_bgr(page.asarray())
+
+    raise InvalidImageError("Upload is not a multi-page document")
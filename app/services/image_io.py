@@ -0,0 +1,168 @@
+import hashlib
+import io
+import os
+import tempfile
+from typing import Optional, Tuple, Union
+import cv2
+import numpy as np
+from ..config import *
+
+
+class ImageTooLargeError(ValueError):
+    """Raised when an upload exceeds the byte or pixel limits."""
+
+
+class InvalidImageError(ValueError):
+    """Raised when an upload cannot be decoded as an image."""
+
+
+class SpooledUpload:
+    """An upload too large to keep in memory, spooled to a uniquely named file."""
+
+    def __init__(self, path: str, size: int):
+        self.path = path
+        self.size = size
+
+    def close(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+Upload = Union[bytes, SpooledUpload]
+
+
+class UploadBuffer:
+    """
+    Accumulates an upload body chunk by chunk, enforcing ``max_bytes``.
+
+    Up to ``UPLOAD_SPOOL_THRESHOLD`` bytes are kept in memory; past that the
+    body is spooled to a temp file under ``UPLOAD_DIR``.
+    """
+
+    def __init__(self, max_bytes: int = MAX_UPLOAD_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._buffer = bytearray()
+        self._spool = None
+        self._path = None
+
+    def write(self, chunk: bytes):
+        self.size += len(chunk)
+        if self.size > self.max_bytes:
+            raise ImageTooLargeError(f"Upload exceeds {self.max_bytes} bytes")
+        if self._spool is None and self.size > UPLOAD_SPOOL_THRESHOLD:
+            fd, self._path = tempfile.mkstemp(prefix="upload_", dir=UPLOAD_DIR)
+            self._spool = os.fdopen(fd, "wb")
+            self._spool.write(self._buffer)
+            self._buffer = bytearray()
+        if self._spool is not None:
+            self._spool.write(chunk)
+        else:
+            self._buffer.extend(chunk)
+
+    def finish(self) -> Upload:
+        if self._spool is None:
+            return bytes(self._buffer)
+        self._spool.close()
+        return SpooledUpload(self._path, self.size)
+
+    def discard(self):
+        if self._spool is not None:
+            self._spool.close()
+            os.remove(self._path)
+            self._spool = None
+
+
+async def read_upload(file, max_bytes: int = MAX_UPLOAD_BYTES) -> Upload:
+    """
+    Read an ``UploadFile`` body, enforcing ``max_bytes``.
+
+    Bodies up to ``UPLOAD_SPOOL_THRESHOLD`` stay in memory; larger ones are
+    spooled to a temp file under ``UPLOAD_DIR`` and later memory-mapped.
+    """
+    buffer = UploadBuffer(max_bytes)
+    try:
+        while True:
+            chunk = await file.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            buffer.write(chunk)
+    except BaseException:
+        buffer.discard()
+        raise
+    return buffer.finish()
+
+
+def release_upload(upload: Upload):
+    """Delete the spool file behind an upload, if any."""
+    if isinstance(upload, SpooledUpload):
+        upload.close()
+
+
+def content_hash(source: Union[Upload, str, np.ndarray]) -> str:
+    """SHA-256 of an upload's bytes (or of an array's pixels and shape)."""
+    digest = hashlib.sha256()
+    if isinstance(source, np.ndarray):
+        digest.update(repr(source.shape).encode())
+        digest.update(np.ascontiguousarray(source).data)
+    elif isinstance(source, (SpooledUpload, str)):
+        path = source.path if isinstance(source, SpooledUpload) else source
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(UPLOAD_CHUNK_SIZE), b""):
+                digest.update(chunk)
+    else:
+        digest.update(source)
+    return digest.hexdigest()
+
+
+def _header_size(data) -> Optional[Tuple[int, int]]:
+    """Read (width, height) from the image header without decoding pixels."""
+    from PIL import Image
+
+    try:
+        with Image.open(io.BytesIO(data) if not isinstance(data, str) else data) as img:
+            return img.size
+    except Image.DecompressionBombError as e:
+        # Pillow refuses headers over twice its own pixel limit, which is far past ours too
+        raise ImageTooLargeError(str(e)) from e
+    except Exception:
+        # Unknown to Pillow; cv2 may still decode it, so check after decoding
+        return None
+
+
+def _check_pixels(width: int, height: int, max_pixels: int):
+    if width * height > max_pixels:
+        raise ImageTooLargeError(f"Image is {width}x{height}, more than {max_pixels} pixels")
+
+
+def decode_image(source: Union[Upload, str, np.ndarray], max_pixels: int = MAX_IMAGE_PIXELS) -> np.ndarray:
+    """
+    Decode an upload (bytes or spooled file), an image path or an array to BGR.
+
+    The pixel count is checked from the header before the full decode.
+    """
+    if isinstance(source, np.ndarray):
+        return source
+
+    if isinstance(source, (SpooledUpload, str)):
+        path = source.path if isinstance(source, SpooledUpload) else source
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"Image file not found: {path}")
+        if os.path.getsize(path) == 0:
+            raise InvalidImageError("Upload is not a readable image")
+        size = _header_size(path)
+        if size is not None:
+            _check_pixels(*size, max_pixels)
+        data = np.memmap(path, dtype=np.uint8, mode="r")
+    else:
+        size = _header_size(source)
+        if size is not None:
+            _check_pixels(*size, max_pixels)
+        data = np.frombuffer(source, dtype=np.uint8)
+
+    image = cv2.imdecode(data, cv2.IMREAD_COLOR) if data.size else None
+    if image is None:
+        raise InvalidImageError("Upload is not a readable image")
+    if size is None:
+        _check_pixels(image.shape[1], image.shape[0], max_pixels)
+    return image
@@ -0,0 +1,215 @@
+import json
+import os
+import shutil
+import sqlite3
+import time
+import uuid
+from pathlib import Path
+from typing import Dict, Optional
+from ..config import *
+from .image_io import Upload, SpooledUpload
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    input_path TEXT NOT NULL,
+    overrides TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    progress TEXT,
+    result TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_status_created ON jobs (status, created_at);
+"""
+
+JSON_COLUMNS = ("overrides", "progress", "result")
+
+
+class JobQueue:
+    """
+    Durable FIFO of processing jobs in a local SQLite database.
+
+    Each job's input is stored under ``directory/<job id>/`` until the job
+    reaches a final state (``done`` or ``failed``). A job is ``queued``,
+    ``running``, ``done`` or ``failed``; ``attempts`` counts how often it
+    was started, so one left ``running`` by a crash is retried by
+    ``recover()`` until ``max_attempts``.
+    """
+
+    def __init__(self, path: str = JOB_QUEUE_DB, directory: str = JOB_QUEUE_DIR,
+                 max_attempts: int = JOB_QUEUE_MAX_ATTEMPTS):
+        self.path = path
+        self.directory = directory
+        self.max_attempts = max_attempts
+        self._initialized = False
+
+    def _connect(self) -> sqlite3.Connection:
+        if not self._initialized:
+            os.makedirs(self.directory, exist_ok=True)
+            with sqlite3.connect(self.path) as db:
+                db.execute("PRAGMA journal_mode=WAL")
+                db.executescript(SCHEMA)
+            self._initialized = True
+        # Autocommit; multi-statement updates open their own transaction
+        db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        db.row_factory = sqlite3.Row
+        return db
+
+    @staticmethod
+    def _row(row: Optional[sqlite3.Row]) -> Optional[Dict]:
+        if row is None:
+            return None
+        job = dict(row)
+        for column in JSON_COLUMNS:
+            if job[column] is not None:
+                job[column] = json.loads(job[column])
+        return job
+
+    def submit(self, upload: Upload, filename: str, overrides: Optional[Dict] = None) -> Dict:
+        """Store the upload and queue a job for it; the upload is consumed."""
+        job_id = uuid.uuid4().hex
+        job_dir = os.path.join(self.directory, job_id)
+        os.makedirs(job_dir)
+        input_path = os.path.join(job_dir, "input" + Path(filename).suffix.lower())
+        if isinstance(upload, SpooledUpload):
+            shutil.move(upload.path, input_path)
+        else:
+            with open(input_path, "wb") as f:
+                f.write(upload)
+
+        db = self._connect()
+        try:
+            db.execute(
+                "INSERT INTO jobs (id, status, filename, input_path, overrides, created_at) "
+                "VALUES (?, 'queued', ?, ?, ?, ?)",
+                (job_id, filename, input_path, json.dumps(overrides or {}), time.time()),
+            )
+        finally:
+            db.close()
+        return self.get(job_id)
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        db = self._connect()
+        try:
+            return self._row(db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone())
+        finally:
+            db.close()
+
+    def claim(self) -> Optional[Dict]:
+        """Mark the oldest queued job as running and return it, or None."""
+        db = self._connect()
+        try:
+            db.execute("BEGIN IMMEDIATE")
+            row = db.execute(
+                "SELECT id FROM jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1"
+            ).fetchone()
+            if row is None:
+                db.execute("COMMIT")
+                return None
+            db.execute(
+                "UPDATE jobs SET status = 'running', attempts = attempts + 1, started_at = ?, "
+                "progress = NULL WHERE id = ?",
+                (time.time(), row["id"]),
+            )
+            db.execute("COMMIT")
+            return self._row(db.execute("SELECT * FROM jobs WHERE id = ?", (row["id"],)).fetchone())
+        except BaseException:
+            if db.in_transaction:
+                db.execute("ROLLBACK")
+            raise
+        finally:
+            db.close()
+
+    def set_progress(self, job_id: str, progress: Dict):
+        db = self._connect()
+        try:
+            db.execute("UPDATE jobs SET progress = ? WHERE id = ?", (json.dumps(progress), job_id))
+        finally:
+            db.close()
+
+    def finish(self, job_id: str, result: Dict):
+        self._close(job_id, "done", result=result, error=None)
+
+    def fail(self, job_id: str, error: str, retry: bool = False):
+        """Record an error; with ``retry`` the job is queued again while it has attempts left."""
+        job = self.get(job_id)
+        if retry and job is not None and job["attempts"] < self.max_attempts:
+            self._update(job_id, status="queued", error=error)
+        else:
+            self._close(job_id, "failed", error=error)
+
+    def requeue(self, job_id: str):
+        """Put a running job back without counting the attempt (e.g. on shutdown)."""
+        db = self._connect()
+        try:
+            db.execute(
+                "UPDATE jobs SET status = 'queued', attempts = attempts - 1, progress = NULL "
+                "WHERE id = ? AND status = 'running'",
+                (job_id,),
+            )
+        finally:
+            db.close()
+
+    def recover(self) -> int:
+        """Retry or fail the jobs a previous process left running; returns how many it found."""
+        db = self._connect()
+        try:
+            rows = db.execute("SELECT id FROM jobs WHERE status = 'running'").fetchall()
+        finally:
+            db.close()
+        for row in rows:
+            self.fail(row["id"], "Server stopped while the job was running", retry=True)
+        return len(rows)
+
+    def counts(self) -> Dict[str, int]:
+        db = self._connect()
+        try:
+            rows = db.execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status").fetchall()
+        finally:
+            db.close()
+        return {row["status"]: row["n"] for row in rows}
+
+    def _update(self, job_id: str, **fields):
+        for column in JSON_COLUMNS:
+            if column in fields:
+                fields[column] = json.dumps(fields[column])
+        assignments = ", ".join(f"{column} = ?" for column in fields)
+        db = self._connect()
+        try:
+            db.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+        finally:
+            db.close()
+
+    def _close(self, job_id: str, status: str, **fields):
+        self._update(job_id, status=status, finished_at=time.time(), **fields)
+        # The result no longer needs the input
+        shutil.rmtree(os.path.join(self.directory, job_id), ignore_errors=True)
+
+
+class JobProgress:
+    """
+    Progress callback handed to the service for one job.
+
+    Picklable, so process workers report through the database themselves.
+    """
+
+    def __init__(self, path: str, job_id: str, page: Optional[int] = None, pages: Optional[int] = None):
+        self.path = path
+        self.job_id = job_id
+        self.page = page
+        self.pages = pages
+
+    def __call__(self, stage: str):
+        progress = {"stage": stage}
+        if self.pages is not None:
+            progress.update(page=self.page, pages=self.pages)
+        db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            db.execute("UPDATE jobs SET progress = ? WHERE id = ?", (json.dumps(progress), self.job_id))
+        finally:
+            db.close()
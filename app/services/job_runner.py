@@ -0,0 +1,126 @@
+import asyncio
+import os
+from pathlib import Path
+from typing import Dict
+from ..config import *
+from .documents import is_document, page_count
+from .image_io import SpooledUpload, ImageTooLargeError
+from .job_queue import JobQueue, JobProgress
+from .metrics import observe_page
+from .worker_pool import ProcessingPool, PoolBusyError, JobTimeoutError
+
+
+class JobRunner:
+    """
+    Drains a ``JobQueue`` in the background through a ``ProcessingPool``.
+
+    ``concurrency`` jobs run at once; pages of a document run one after the
+    other within their job, each allowed ``timeout`` seconds. Jobs that
+    fail because of their input (bad image, unknown setting) or run out of
+    time fail for good; anything else, including a crashed worker, is
+    retried while the job has attempts left.
+    """
+
+    def __init__(self, queue: JobQueue, pool: ProcessingPool,
+                 concurrency: int = JOB_QUEUE_CONCURRENCY, poll_interval: float = JOB_QUEUE_POLL_INTERVAL,
+                 timeout: float = JOB_QUEUE_TIMEOUT_SECONDS):
+        self.queue = queue
+        self.pool = pool
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+        # Off when several processes share the queue and recovery ran before they started
+        self.recover_on_start = True
+        self._wakeup = asyncio.Event()
+        self._tasks = []
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    async def start(self):
+        if self.recover_on_start:
+            recovered = await asyncio.to_thread(self.queue.recover)
+            if recovered:
+                print(f"Job queue: {recovered} job(s) interrupted by the last shutdown were requeued or failed")
+        self._tasks = [asyncio.create_task(self._drain()) for _ in range(self.concurrency)]
+
+    async def stop(self):
+        """Stop taking jobs; jobs cut off mid-run go back to the queue."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def notify(self):
+        """Wake idle drainers, e.g. right after a submit."""
+        self._wakeup.set()
+
+    async def _drain(self):
+        while True:
+            self._wakeup.clear()
+            job = await asyncio.to_thread(self.queue.claim)
+            if job is None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._run(job)
+
+    async def _run(self, job: Dict):
+        try:
+            result = await self._execute(job)
+        except asyncio.CancelledError:
+            # Shutting down: not the job's fault, so the attempt does not count
+            self.queue.requeue(job["id"])
+            raise
+        except PoolBusyError:
+            await asyncio.to_thread(self.queue.requeue, job["id"])
+            await asyncio.sleep(self.poll_interval)
+        except (ValueError, LookupError) as e:
+            await asyncio.to_thread(self.queue.fail, job["id"], str(e))
+        except JobTimeoutError as e:
+            # Its worker may still be busy with it; another attempt would only pile up more
+            await asyncio.to_thread(self.queue.fail, job["id"], str(e))
+        except Exception as e:
+            await asyncio.to_thread(self.queue.fail, job["id"], f"{type(e).__name__}: {e}", True)
+        else:
+            await asyncio.to_thread(self.queue.finish, job["id"], result)
+
+    async def _execute(self, job: Dict) -> Dict:
+        upload = SpooledUpload(job["input_path"], os.path.getsize(job["input_path"]))
+        base_name = f"processed_{Path(job['filename']).stem}"
+        overrides = job["overrides"]
+
+        pages = await asyncio.to_thread(page_count, upload) if is_document(upload) else 0
+        if pages <= 1:
+            # A one-page document gets the same result as an image
+            if pages:
+                method, args = "process_document_page", (upload, 0, base_name)
+            else:
+                method, args = "process_image", (upload, base_name)
+            result = await self.pool.run(
+                method, *args,
+                overrides=overrides, progress=JobProgress(self.queue.path, job["id"]), timeout=self.timeout,
+            )
+            observe_page(result)
+            return result
+
+        if pages > MAX_DOCUMENT_PAGES:
+            raise ImageTooLargeError(f"Document has {pages} pages, more than {MAX_DOCUMENT_PAGES}")
+        results = []
+        for index in range(pages):
+            # A retried job redoes finished pages from the result cache
+            result = await self.pool.run(
+                "process_document_page", upload, index, f"{base_name}_p{index + 1}",
+                overrides=overrides, progress=JobProgress(self.queue.path, job["id"], index + 1, pages),
+                timeout=self.timeout,
+            )
+            observe_page(result)
+            results.append(result)
+        return {
+            "success": True,
+            "total_processed": sum(page["total_processed"] for page in results),
+            "pages": results,
+        }
@@ -0,0 +1,247 @@
+import hashlib
+import json
+import os
+import re
+import threading
+from typing import Dict, Optional, Sequence, Tuple
+import cv2
+import numpy as np
+from ..config import *
+
+Box = Tuple[int, int, int, int]  # x, y, w, h
+Field = Tuple[int, int, int, int]  # x0, y0, x1, y1
+
+LAYOUT_NAME_PATTERN = r"[A-Za-z0-9_-]{1,64}"
+# Thumbnail pixels masked around each slot and name field, so slot frames and
+# the edges of whatever fills them do not count either way
+SLOT_MASK_PAD = 2
+FIELD_MASK_PAD = 1
+
+
+def page_thumbnail(image_gray: np.ndarray, size: Tuple[int, int]) -> np.ndarray:
+    """Inverted (ink is bright) thumbnail of ``size`` (width, height)."""
+    # Halving with pyrDown first is several times faster than one INTER_AREA resize from full size
+    while image_gray.shape[1] >= 2 * size[0] and image_gray.shape[0] >= 2 * size[1]:
+        image_gray = cv2.pyrDown(image_gray)
+    return 255 - cv2.resize(image_gray, size, interpolation=cv2.INTER_AREA)
+
+
+def _peak_offset(scores: np.ndarray, x: int, y: int) -> Tuple[float, float]:
+    """Sub-pixel position of a correlation peak from a parabola through its neighbours."""
+    def refine(before, peak, after):
+        curvature = before - 2 * peak + after
+        return 0.5 * (before - after) / curvature if curvature < 0 else 0.0
+
+    dx = refine(scores[y, x - 1], scores[y, x], scores[y, x + 1]) if 0 < x < scores.shape[1] - 1 else 0.0
+    dy = refine(scores[y - 1, x], scores[y, x], scores[y + 1, x]) if 0 < y < scores.shape[0] - 1 else 0.0
+    return x + dx, y + dy
+
+
+class Layout:
+    """
+    A registered form: page size, photo slots and name fields (in the pixels
+    of the page it was registered from) and a thumbnail fingerprint of it.
+    """
+
+    def __init__(self, name: str, width: int, height: int, slots: Sequence[Box], fields: Sequence[Field],
+                 thumbnail: np.ndarray):
+        self.name = name
+        self.width = width
+        self.height = height
+        self.slots = [tuple(int(v) for v in slot) for slot in slots]
+        self.fields = [tuple(int(v) for v in field) for field in fields]
+        self.thumbnail = thumbnail
+        self.template = thumbnail.astype(np.float32)
+        self.mask = self._mask()
+
+    @property
+    def thumb_size(self) -> Tuple[int, int]:
+        return self.thumbnail.shape[1], self.thumbnail.shape[0]
+
+    def _mask(self) -> np.ndarray:
+        """Everything but the slots and name fields: the printed form itself."""
+        mask = np.ones(self.thumbnail.shape, dtype=np.float32)
+        fx = self.thumbnail.shape[1] / self.width
+        fy = self.thumbnail.shape[0] / self.height
+        rects = [((x, y, x + w, y + h), SLOT_MASK_PAD) for x, y, w, h in self.slots]
+        rects += [(field, FIELD_MASK_PAD) for field in self.fields]
+        for (x0, y0, x1, y1), pad in rects:
+            mask[max(0, int(y0 * fy) - pad):int(np.ceil(y1 * fy)) + pad,
+                 max(0, int(x0 * fx) - pad):int(np.ceil(x1 * fx)) + pad] = 0
+        return mask
+
+    def describe(self) -> Dict:
+        return {
+            "name": self.name,
+            "width": self.width,
+            "height": self.height,
+            "slots": [{"x": x, "y": y, "w": w, "h": h} for x, y, w, h in self.slots],
+            "name_fields": [{"x0": x0, "y0": y0, "x1": x1, "y1": y1} for x0, y0, x1, y1 in self.fields],
+        }
+
+
+class LayoutRegistry:
+    """
+    Registered form layouts, kept in memory and stored under ``directory``
+    as ``<name>.json`` plus a ``<name>.png`` thumbnail.
+
+    The in-memory copy is reloaded when the directory changes, so layouts
+    registered by another worker process are picked up on the next page.
+    ``match`` aligns a page to the best-scoring layout: the page is
+    thumbnailed at the layout's thumbnail size and correlated with it
+    (``TM_CCOEFF_NORMED``) over shifts of up to LAYOUT_MAX_SHIFT, with the
+    slots and name fields masked out so only the printed form counts.
+    """
+
+    def __init__(self, directory: str = LAYOUT_DIR, thumb_side: int = LAYOUT_THUMB_SIDE,
+                 max_shift: float = LAYOUT_MAX_SHIFT, aspect_tolerance: float = LAYOUT_ASPECT_TOLERANCE):
+        self.directory = directory
+        self.thumb_side = thumb_side
+        self.max_shift = max_shift
+        self.aspect_tolerance = aspect_tolerance
+        self._lock = threading.Lock()
+        self._layouts: Dict[str, Layout] = {}
+        self._stamp = None
+        self._version = ""
+
+    def _directory_stamp(self) -> Optional[int]:
+        try:
+            return os.stat(self.directory).st_mtime_ns
+        except OSError:
+            return None
+
+    def _load(self, name: str) -> Optional[Layout]:
+        try:
+            with open(os.path.join(self.directory, f"{name}.json")) as f:
+                data = json.load(f)
+            thumbnail = cv2.imread(os.path.join(self.directory, f"{name}.png"), cv2.IMREAD_GRAYSCALE)
+        except (OSError, ValueError) as e:
+            print(f"Skipping layout {name}: {e}")
+            return None
+        if thumbnail is None:
+            return None
+        return Layout(name, data["width"], data["height"], data["slots"], data["fields"], thumbnail)
+
+    def _refresh(self):
+        stamp = self._directory_stamp()
+        if stamp == self._stamp:
+            return
+        with self._lock:
+            if stamp == self._stamp:
+                return
+            layouts = {}
+            if stamp is not None:
+                for entry in sorted(os.listdir(self.directory)):
+                    name, extension = os.path.splitext(entry)
+                    if extension == ".json" and re.fullmatch(LAYOUT_NAME_PATTERN, name):
+                        layout = self._load(name)
+                        if layout is not None:
+                            layouts[name] = layout
+            self._layouts = layouts
+            self._version = hashlib.sha256(f"{stamp}:{sorted(layouts)}".encode()).hexdigest()[:16]
+            self._stamp = stamp
+
+    def layouts(self) -> Dict[str, Layout]:
+        self._refresh()
+        return self._layouts
+
+    @property
+    def version(self) -> str:
+        """Changes whenever a layout is registered, replaced or removed (part of cache keys)."""
+        self._refresh()
+        return self._version
+
+    def register(self, name: str, image_gray: np.ndarray, slots: Sequence[Box], fields: Sequence[Field]) -> Layout:
+        """Store a layout whose ``slots`` and ``fields`` are in ``image_gray``'s pixels."""
+        if not re.fullmatch(LAYOUT_NAME_PATTERN, name):
+            raise ValueError(f"Layout names are 1-64 letters, digits, '-' or '_': {name!r}")
+        if not slots:
+            raise ValueError("A layout needs at least one photo slot")
+        if len(fields) != len(slots):
+            raise ValueError("A layout needs one name field per photo slot")
+        height, width = image_gray.shape[:2]
+        scale = self.thumb_side / max(height, width)
+        thumbnail = page_thumbnail(image_gray, (max(1, round(width * scale)), max(1, round(height * scale))))
+        layout = Layout(name, width, height, slots, fields, thumbnail)
+
+        os.makedirs(self.directory, exist_ok=True)
+        base = os.path.join(self.directory, name)
+        tmp = f"{base}.{os.getpid()}.{threading.get_ident()}.tmp"
+        cv2.imwrite(f"{tmp}.png", thumbnail)
+        with open(f"{tmp}.json", "w") as f:
+            json.dump({"width": width, "height": height, "slots": layout.slots, "fields": layout.fields}, f)
+        # Thumbnail first: a reader that sees the new JSON also sees its thumbnail
+        os.replace(f"{tmp}.png", f"{base}.png")
+        os.replace(f"{tmp}.json", f"{base}.json")
+        return layout
+
+    def remove(self, name: str) -> bool:
+        if not re.fullmatch(LAYOUT_NAME_PATTERN, name):
+            return False
+        base = os.path.join(self.directory, name)
+        try:
+            os.remove(f"{base}.json")
+        except FileNotFoundError:
+            return False
+        try:
+            os.remove(f"{base}.png")
+        except FileNotFoundError:
+            pass
+        return True
+
+    def _score(self, layout: Layout, thumbnail: np.ndarray) -> Tuple[float, float, float]:
+        """Best correlation of ``layout`` with a page thumbnail, and the page's shift in thumbnail pixels."""
+        width, height = layout.thumb_size
+        mx = max(1, round(width * self.max_shift))
+        my = max(1, round(height * self.max_shift))
+        # Ink-free border, so content shifted off the page compares as blank paper
+        padded = cv2.copyMakeBorder(thumbnail, my, my, mx, mx, cv2.BORDER_CONSTANT, value=0).astype(np.float32)
+        scores = cv2.matchTemplate(padded, layout.template, cv2.TM_CCOEFF_NORMED, mask=layout.mask)
+        scores = np.nan_to_num(scores, nan=-1.0, posinf=-1.0, neginf=-1.0)
+        _, best, _, (x, y) = cv2.minMaxLoc(scores)
+        px, py = _peak_offset(scores, x, y)
+        return best, px - mx, py - my
+
+    def match(self, image_gray: np.ndarray, threshold: float = LAYOUT_MATCH_THRESHOLD) -> Optional[Dict]:
+        """
+        Align the page to the best registered layout scoring at least
+        ``threshold``; returns its ``name``, ``score`` and the ``slots`` and
+        ``fields`` mapped to page coordinates, or None.
+        """
+        layouts = self.layouts()
+        if not layouts:
+            return None
+        height, width = image_gray.shape[:2]
+        thumbnails = {}
+        best = None
+        for layout in layouts.values():
+            if abs((width / height) / (layout.width / layout.height) - 1) > self.aspect_tolerance:
+                continue
+            if layout.thumb_size not in thumbnails:
+                thumbnails[layout.thumb_size] = page_thumbnail(image_gray, layout.thumb_size)
+            score, dx, dy = self._score(layout, thumbnails[layout.thumb_size])
+            if score >= threshold and (best is None or score > best[0]):
+                best = (score, layout, dx, dy)
+        if best is None:
+            return None
+
+        score, layout, dx, dy = best
+        # Layout pixels -> page pixels: scale to the page, then shift by the offset found on the thumbnail
+        sx = width / layout.width
+        sy = height / layout.height
+        ox = dx * width / layout.thumb_size[0]
+        oy = dy * height / layout.thumb_size[1]
+
+        def rect(x0, y0, x1, y1) -> Field:
+            return (min(width, max(0, round(x0 * sx + ox))), min(height, max(0, round(y0 * sy + oy))),
+                    min(width, max(0, round(x1 * sx + ox))), min(height, max(0, round(y1 * sy + oy))))
+
+        slots = []
+        fields = []
+        for (x, y, w, h), field in zip(layout.slots, layout.fields):
+            x0, y0, x1, y1 = rect(x, y, x + w, y + h)
+            # A slot shifted off the page has nothing to crop
+            if x1 > x0 and y1 > y0:
+                slots.append((x0, y0, x1 - x0, y1 - y0))
+                fields.append(rect(*field))
+        return {"name": layout.name, "score": round(float(score), 4), "slots": slots, "fields": fields}
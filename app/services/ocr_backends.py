@@ -0,0 +1,240 @@
+import multiprocessing
+import re
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Sequence, Tuple
+import cv2
+import numpy as np
+from ..config import *
+from .timing import StageTimer
+
+# (x0, y0, x1, y1) in page coordinates
+Band = Tuple[int, int, int, int]
+
+
+class OcrBackend:
+    """
+    Reads words from a grayscale image.
+
+    Words are dicts with ``text``, ``x``, ``y``, ``w``, ``h`` (page
+    coordinates) and ``conf`` (0-1); only words above the backend's
+    confidence setting are returned.
+    """
+
+    name = ""
+    threshold_setting = ""
+
+    @property
+    def loaded(self) -> bool:
+        raise NotImplementedError
+
+    def load(self, timer: StageTimer):
+        """Load models once; phases are timed on ``timer``."""
+        raise NotImplementedError
+
+    def read(self, image_gray: np.ndarray, offset: Tuple[int, int], settings: Dict) -> List[Dict]:
+        raise NotImplementedError
+
+    def read_bands(self, image_gray: np.ndarray, bands: Sequence[Band], settings: Dict) -> List[List[Dict]]:
+        """Read each band of the page; one word list per band."""
+        return [
+            self.read(image_gray[y0:y1, x0:x1], (x0, y0), settings) if x1 > x0 and y1 > y0 else []
+            for x0, y0, x1, y1 in bands
+        ]
+
+    def shutdown(self):
+        pass
+
+
+# Set once a caller (e.g. the pre-fork parent) has chosen this process's torch thread counts
+_torch_threads_configured = False
+
+
+def configure_torch_threads(threads: Optional[int] = OCR_TORCH_THREADS,
+                            interop_threads: Optional[int] = OCR_TORCH_INTEROP_THREADS):
+    """Set this process's torch thread counts (None leaves a count alone)."""
+    global _torch_threads_configured
+    import torch
+
+    _torch_threads_configured = True
+
+    if threads:
+        torch.set_num_threads(threads)
+    if interop_threads and torch.get_num_interop_threads() != interop_threads:
+        try:
+            torch.set_num_interop_threads(interop_threads)
+        except RuntimeError:
+            # Only allowed before the first inter-op parallel call in the process
+            print(f"torch inter-op threads already fixed at {torch.get_num_interop_threads()}")
+
+
+class EasyOcrBackend(OcrBackend):
+    """
+    EasyOCR with the CPU profile from config: torch thread counts per worker,
+    optional int8 recognizer and inference under ``torch.inference_mode``.
+    """
+
+    name = "easyocr"
+    threshold_setting = "EASYOCR_CONFIDENCE_THRESHOLD"
+
+    def __init__(self, languages: Sequence[str] = OCR_LANGUAGES, quantize: bool = OCR_QUANTIZE):
+        self.languages = list(languages)
+        self.quantize = quantize
+        self.reader = None
+        self._torch = None
+
+    @property
+    def loaded(self) -> bool:
+        return self.reader is not None
+
+    def load(self, timer: StageTimer):
+        with timer.stage("import_easyocr"):
+            import easyocr
+            import torch
+        # The pre-fork parent pins torch to one thread before loading, so no
+        # OpenMP pool exists at fork; leave counts chosen by a caller alone
+        if not _torch_threads_configured:
+            configure_torch_threads()
+        with timer.stage("easyocr_reader"):
+            print(f"Initializing EasyOCR ({torch.get_num_threads()} torch threads, "
+                  f"{'int8' if self.quantize else 'fp32'} recognizer)...")
+            # EasyOCR 1.7 quantizes the CPU detector either way
+            self.reader = easyocr.Reader(self.languages, quantize=self.quantize)
+            print("EasyOCR initialized.")
+        self._torch = torch
+
+    def readtext(self, image_gray: np.ndarray) -> List:
+        # EasyOCR wraps its models in no_grad; inference_mode also skips version counting
+        with self._torch.inference_mode():
+            return self.reader.readtext(image_gray)
+
+    def recognize(self, image_gray: np.ndarray, horizontal_list: List, batch_size: int) -> List:
+        """Recognizer only, on the given [x_min, x_max, y_min, y_max] boxes (no CRAFT detection)."""
+        with self._torch.inference_mode():
+            return self.reader.recognize(image_gray, horizontal_list=horizontal_list, free_list=[],
+                                         batch_size=batch_size)
+
+    def read(self, image_gray: np.ndarray, offset: Tuple[int, int], settings: Dict) -> List[Dict]:
+        off_x, off_y = offset
+        words = []
+        for (bbox, text, conf) in self.readtext(image_gray):
+            if conf > settings[self.threshold_setting] and text.strip():
+                (tl, tr, br, bl) = bbox
+                words.append({
+                    'text': text,
+                    'x': int(tl[0]) + off_x,
+                    'y': int(tl[1]) + off_y,
+                    'w': int(br[0] - tl[0]),
+                    'h': int(br[1] - tl[1]),
+                    'conf': round(float(conf), 4)
+                })
+        return words
+
+
+# Settings the Tesseract worker processes need, sent with every band
+TESSERACT_SETTINGS = ("TESSERACT_LANGUAGES", "TESSERACT_CONFIG", "TESSERACT_WHITELIST", "TESSERACT_UPSCALE",
+                      "TESSERACT_CONFIDENCE_THRESHOLD")
+
+
+def preprocess_for_tesseract(image_gray: np.ndarray, scale: int = TESSERACT_UPSCALE) -> np.ndarray:
+    """Upscale with cubic interpolation and binarize with Otsu (as in testing_complete_optimized.py)."""
+    scaled = cv2.resize(image_gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_CUBIC)
+    _, binary = cv2.threshold(scaled, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    return binary
+
+
+def tesseract_words(image_gray: np.ndarray, offset: Tuple[int, int], settings: Dict) -> List[Dict]:
+    """Preprocess and read one image with Tesseract; runs inside the backend's worker processes."""
+    import pytesseract
+
+    scale = settings["TESSERACT_UPSCALE"]
+    threshold = settings["TESSERACT_CONFIDENCE_THRESHOLD"]
+    off_x, off_y = offset
+    config = settings["TESSERACT_CONFIG"]
+    whitelist = settings["TESSERACT_WHITELIST"]
+    if whitelist:
+        # Spliced into tesseract's command line, so nothing but letters and spaces
+        if not re.fullmatch(r"[A-Za-z ]+", whitelist):
+            raise ValueError("TESSERACT_WHITELIST may only hold letters and spaces")
+        config += f" -c tessedit_char_whitelist=\"{whitelist}\""
+    data = pytesseract.image_to_data(
+        preprocess_for_tesseract(image_gray, scale),
+        lang=settings["TESSERACT_LANGUAGES"],
+        config=config,
+        output_type=pytesseract.Output.DICT,
+    )
+    words = []
+    for text, conf, left, top, width, height in zip(
+            data["text"], data["conf"], data["left"], data["top"], data["width"], data["height"]):
+        conf = float(conf) / 100
+        # Tesseract reports -1 for layout rows (blocks, lines) that carry no text
+        if conf > threshold and text.strip():
+            words.append({
+                'text': text,
+                'x': left // scale + off_x,
+                'y': top // scale + off_y,
+                'w': width // scale,
+                'h': height // scale,
+                'conf': round(conf, 4)
+            })
+    return words
+
+
+class TesseractBackend(OcrBackend):
+    """
+    Tesseract through pytesseract, with the preprocessing and letter
+    whitelist of ``testing_complete_optimized.py``.
+
+    Name bands are read in parallel on a pool of ``workers`` processes (each
+    call also starts a ``tesseract`` subprocess), so one page's bands use
+    several cores however the request pool is configured.
+    """
+
+    name = "tesseract"
+    threshold_setting = "TESSERACT_CONFIDENCE_THRESHOLD"
+
+    def __init__(self, workers: int = TESSERACT_WORKERS):
+        self.workers = workers
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self) -> bool:
+        return self._executor is not None
+
+    def load(self, timer: StageTimer):
+        with timer.stage("tesseract"):
+            import pytesseract
+
+            print(f"Tesseract {pytesseract.get_tesseract_version()} with {self.workers} worker processes")
+            with self._lock:
+                if self._executor is None:
+                    # Spawned, not forked: the parent may hold torch and OpenCV threads
+                    self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                         mp_context=multiprocessing.get_context("spawn"))
+
+    def read(self, image_gray: np.ndarray, offset: Tuple[int, int], settings: Dict) -> List[Dict]:
+        # A whole page gains nothing from a pool hop
+        return tesseract_words(image_gray, offset, settings)
+
+    def read_bands(self, image_gray: np.ndarray, bands: Sequence[Band], settings: Dict) -> List[List[Dict]]:
+        options = {name: settings[name] for name in TESSERACT_SETTINGS}
+        futures = {}
+        for i, (x0, y0, x1, y1) in enumerate(bands):
+            if x1 > x0 and y1 > y0:
+                # Copies only the band, not the page, to the worker
+                futures[i] = self._executor.submit(
+                    tesseract_words, np.ascontiguousarray(image_gray[y0:y1, x0:x1]), (x0, y0), options)
+        return [futures[i].result() if i in futures else [] for i in range(len(bands))]
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(cancel_futures=True)
+                self._executor = None
+
+
+OCR_BACKENDS = {
+    EasyOcrBackend.name: EasyOcrBackend,
+    TesseractBackend.name: TesseractBackend,
+}
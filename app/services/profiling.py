@@ -0,0 +1,152 @@
+import cProfile
+import hmac
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+from typing import Dict, Optional, Sequence, Tuple
+from ..config import *
+
+PROFILE_MODES = ("cpu", "memory")
+CPU_PROFILE_NAME = "profile.prof"
+MEMORY_SNAPSHOT_NAME = "allocations.tracemalloc"
+
+# tracemalloc is process-wide, and so is cProfile from Python 3.12 (enabling
+# a second one raises): one profiled call per mode at a time
+_memory_lock = threading.Lock()
+_cpu_lock = threading.Lock()
+
+
+def profile_modes(header: Optional[str], token: Optional[str]) -> Tuple[str, ...]:
+    """
+    Parse an ``X-Profile`` header (e.g. ``"cpu"``, ``"cpu,memory"``).
+
+    Raises ``PermissionError`` unless profiling is enabled and ``token``
+    matches PROFILING_ADMIN_TOKEN, and ``ValueError`` for unknown modes.
+    """
+    if not header:
+        return ()
+    if not PROFILING_ENABLED or not PROFILING_ADMIN_TOKEN or token is None \
+            or not hmac.compare_digest(token.encode(), PROFILING_ADMIN_TOKEN.encode()):
+        raise PermissionError("Profiling is not enabled for this request")
+    modes = tuple(dict.fromkeys(mode.strip().lower() for mode in header.split(",") if mode.strip()))
+    unknown = [mode for mode in modes if mode not in PROFILE_MODES]
+    if unknown:
+        raise ValueError(f"Unknown profile modes: {', '.join(unknown)}")
+    return modes
+
+
+class RequestProfiler:
+    """
+    Wraps one pipeline call in cProfile and/or tracemalloc.
+
+    Before Python 3.12 cProfile only sees the calling thread, so work
+    handed to the crop writer pool shows up as time spent waiting on its
+    futures; from 3.12 it records every thread. That, and tracemalloc,
+    which traces the whole process, means that with a thread pool the
+    requests running at the same time are included.
+    """
+
+    def __init__(self, modes: Sequence[str], top_n: int = PROFILING_TOP_N):
+        self.modes = tuple(modes)
+        self.top_n = top_n
+        self.cpu = cProfile.Profile() if "cpu" in self.modes else None
+        self.snapshot = None
+        self.wall_ms = 0.0
+        self._tracing = False
+        self._locks = []
+
+    def __enter__(self) -> "RequestProfiler":
+        try:
+            if self.cpu is not None:
+                _cpu_lock.acquire()
+                self._locks.append(_cpu_lock)
+            if "memory" in self.modes:
+                _memory_lock.acquire()
+                self._locks.append(_memory_lock)
+                # Already tracing (e.g. under the benchmark): reuse it, leave it running
+                self._tracing = not tracemalloc.is_tracing()
+                if self._tracing:
+                    tracemalloc.start(PROFILING_TRACEMALLOC_FRAMES)
+            self._start = time.perf_counter()
+            if self.cpu is not None:
+                # Raises ValueError on 3.12+ if a profiler other than ours is active
+                self.cpu.enable()
+        except BaseException:
+            self._release()
+            raise
+        return self
+
+    def _release(self):
+        if self._tracing:
+            tracemalloc.stop()
+            self._tracing = False
+        while self._locks:
+            self._locks.pop().release()
+
+    def __exit__(self, *exc_info):
+        if self.cpu is not None:
+            self.cpu.disable()
+        self.wall_ms = (time.perf_counter() - self._start) * 1000
+        try:
+            if "memory" in self.modes:
+                self.snapshot = tracemalloc.take_snapshot().filter_traces((
+                    tracemalloc.Filter(False, tracemalloc.__file__),
+                    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+                ))
+        finally:
+            self._release()
+        return False
+
+    def _cpu_summary(self) -> Dict:
+        stats = pstats.Stats(self.cpu)
+        rows = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)
+        top = []
+        for (filename, line, function), (_, calls, own, cumulative, _) in rows[:self.top_n]:
+            top.append({
+                "function": f"{function} ({os.path.basename(filename)}:{line})" if line else function,
+                "calls": calls,
+                "own_ms": round(own * 1000, 2),
+                "cumulative_ms": round(cumulative * 1000, 2),
+            })
+        return {"wall_ms": round(self.wall_ms, 2), "top": top}
+
+    def _memory_summary(self, stage_peaks: Dict[str, int]) -> Dict:
+        top = []
+        for stat in self.snapshot.statistics("lineno")[:self.top_n]:
+            frame = stat.traceback[0]
+            top.append({
+                "location": f"{frame.filename}:{frame.lineno}",
+                "size_bytes": stat.size,
+                "count": stat.count,
+            })
+        return {
+            "peak_bytes": max(stage_peaks.values(), default=0),
+            "stage_peaks": stage_peaks,
+            "top": top,
+        }
+
+    def summary(self, stage_peaks: Optional[Dict[str, int]] = None) -> Dict:
+        """
+        Top-N hot functions (by cumulative time) and allocation sites still
+        held at the end. ``stage_peaks`` are the per-stage peaks the pipeline
+        measured while traced (``StageTimer`` resets the peak at each stage).
+        """
+        summary = {"modes": list(self.modes)}
+        if self.cpu is not None:
+            summary["cpu"] = self._cpu_summary()
+        if self.snapshot is not None:
+            summary["memory"] = self._memory_summary(stage_peaks or {})
+        return summary
+
+    def dump(self, folder: str) -> Tuple[Dict[str, str], int]:
+        """Write the raw profile and snapshot into ``folder``; returns their paths and total size."""
+        paths = {}
+        if self.cpu is not None:
+            paths["cpu"] = os.path.join(folder, CPU_PROFILE_NAME)
+            self.cpu.dump_stats(paths["cpu"])
+        if self.snapshot is not None:
+            paths["memory"] = os.path.join(folder, MEMORY_SNAPSHOT_NAME)
+            self.snapshot.dump(paths["memory"])
+        return paths, sum(os.path.getsize(path) for path in paths.values())
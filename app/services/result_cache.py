@@ -0,0 +1,145 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+from ..config import *
+
+
+class ResultCache:
+    """
+    Content-addressed cache of processing results.
+
+    Entries are JSON files under ``directory`` (sharded by key prefix), kept
+    in LRU order by mtime and trimmed to ``max_bytes``. The most recently
+    used entries are also held in memory. A stored result is only returned
+    while the crops it points to still exist.
+    """
+
+    def __init__(
+        self,
+        directory: str = RESULT_CACHE_DIR,
+        max_bytes: int = RESULT_CACHE_MAX_BYTES,
+        memory_entries: int = RESULT_CACHE_MEMORY_ENTRIES,
+    ):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.memory_entries = memory_entries
+        self._memory: "OrderedDict[str, Dict]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk_bytes: Optional[int] = None
+        self.hits = 0
+        self.memory_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(content_hash: str, settings: Dict) -> str:
+        """Combine the input's content hash with the settings that shape the result."""
+        settings_json = json.dumps(settings, sort_keys=True, default=str)
+        return hashlib.sha256(f"{content_hash}:{settings_json}".encode()).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def _is_valid(self, result: Dict) -> bool:
+        return all(
+            item.get("image_path") is None or os.path.exists(item["image_path"])
+            for item in result.get("results", [])
+        )
+
+    def get(self, key: str) -> Optional[Dict]:
+        """Return the cached result for ``key`` or None, updating the counters."""
+        with self._lock:
+            result = self._memory.get(key)
+            if result is not None and self._is_valid(result):
+                self._memory.move_to_end(key)
+                self.hits += 1
+                self.memory_hits += 1
+                return result
+            self._memory.pop(key, None)
+
+        path = self._path(key)
+        try:
+            with open(path) as f:
+                result = json.load(f)
+        except (OSError, ValueError):
+            result = None
+
+        with self._lock:
+            if result is None or not self._is_valid(result):
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._remember(key, result)
+        try:
+            # mtime marks recency for disk eviction
+            os.utime(path)
+        except OSError:
+            pass
+        return result
+
+    def put(self, key: str, result: Dict):
+        """Store a result in both tiers and trim the disk tier if needed."""
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        data = json.dumps(result).encode()
+        replaced = os.path.getsize(path) if os.path.exists(path) else 0
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            self._remember(key, result)
+            if self._disk_bytes is None:
+                self._disk_bytes = sum(os.path.getsize(p) for p, _ in self._disk_entries())
+            else:
+                self._disk_bytes += len(data) - replaced
+            if self._disk_bytes > self.max_bytes:
+                self._evict()
+
+    def _remember(self, key: str, result: Dict):
+        self._memory[key] = result
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _disk_entries(self):
+        if not os.path.isdir(self.directory):
+            return []
+        entries = []
+        for shard in os.scandir(self.directory):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if entry.name.endswith(".json"):
+                    entries.append((entry.path, entry.stat().st_mtime))
+        return entries
+
+    def _evict(self):
+        """Drop least recently used disk entries until 90% of ``max_bytes`` is left."""
+        entries = sorted(self._disk_entries(), key=lambda e: e[1])
+        total = sum(os.path.getsize(p) for p, _ in entries)
+        target = self.max_bytes * 0.9
+        for path, _ in entries:
+            if total <= target:
+                break
+            try:
+                size = os.path.getsize(path)
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            self._memory.pop(os.path.basename(path)[:-len(".json")], None)
+        self._disk_bytes = total
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "memory_hits": self.memory_hits,
+                "misses": self.misses,
+                "memory_entries": len(self._memory),
+                "disk_bytes": self._disk_bytes,
+            }
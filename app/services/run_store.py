@@ -0,0 +1,146 @@
+import os
+import re
+import secrets
+import shutil
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+from ..config import *
+
+# Per-shard index of finished runs: one "<run folder>\t<bytes>" line each
+RUNS_INDEX = ".runs"
+SHARD_PATTERN = re.compile(r"^\d{4}/\d{2}/\d{2}/\d{2}$")
+
+
+class RunStore:
+    """
+    Allocates run folders under ``directory`` and expires old ones.
+
+    Runs live in hourly shards, ``YYYY/MM/DD/HH/<run id>-<name>``, where the
+    run id is the UTC time plus 48 random bits, so allocating a folder is a
+    single ``makedirs`` however many runs exist. Each shard keeps an
+    append-only ``.runs`` index of finished runs and their sizes, which is
+    all ``collect`` reads to enforce ``max_age_days`` and ``max_bytes``
+    (runs from the last two hours count towards the size but are kept).
+    Folders outside the shard layout (e.g. from older versions) are left alone.
+    """
+
+    def __init__(self, directory: str = RESULT_DIR, max_age_days: Optional[float] = RESULT_RETENTION_DAYS,
+                 max_bytes: Optional[int] = RESULT_RETENTION_MAX_BYTES):
+        self.directory = directory
+        self.max_age_days = max_age_days
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def _safe_name(name: str) -> str:
+        name = re.sub(r"[\\/\x00]+", "-", name).strip(". ")
+        return name[:80] or "run"
+
+    def allocate(self, name: str) -> Tuple[str, str]:
+        """Create a new, unique run folder; returns ``(run_id, path)``."""
+        while True:
+            now = datetime.now(timezone.utc)
+            run_id = f"{now:%Y%m%dT%H%M%S}-{secrets.token_hex(6)}"
+            path = os.path.join(self.directory, f"{now:%Y/%m/%d/%H}", f"{run_id}-{self._safe_name(name)}")
+            try:
+                os.makedirs(path)
+                return run_id, path
+            except FileExistsError:
+                # 48 random bits within one second; practically unreachable
+                continue
+
+    def record(self, path: str, size: int):
+        """Add a finished run to its shard's index (one small append)."""
+        with open(os.path.join(os.path.dirname(path), RUNS_INDEX), "a") as f:
+            f.write(f"{os.path.basename(path)}\t{size}\n")
+
+    def _shards(self) -> List[str]:
+        """Shard paths relative to ``directory``, oldest first."""
+        shards = []
+        for level in range(4):
+            parents = shards if level else [""]
+            shards = []
+            for parent in parents:
+                try:
+                    names = sorted(
+                        entry.name for entry in os.scandir(os.path.join(self.directory, parent))
+                        if entry.is_dir() and entry.name.isdigit()
+                    )
+                except OSError:
+                    continue
+                shards.extend(os.path.join(parent, name) if parent else name for name in names)
+        return [shard for shard in shards if SHARD_PATTERN.match(shard.replace(os.sep, "/"))]
+
+    def _read_index(self, shard: str) -> List[Tuple[str, int]]:
+        try:
+            with open(os.path.join(self.directory, shard, RUNS_INDEX)) as f:
+                lines = [line.rstrip("\n").rsplit("\t", 1) for line in f if "\t" in line]
+        except OSError:
+            return []
+        return [(name, int(size)) for name, size in lines]
+
+    def _write_index(self, shard: str, runs: List[Tuple[str, int]]):
+        path = os.path.join(self.directory, shard, RUNS_INDEX)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            f.writelines(f"{name}\t{size}\n" for name, size in runs)
+        os.replace(tmp_path, path)
+
+    def _remove_shard(self, shard: str):
+        shutil.rmtree(os.path.join(self.directory, shard), ignore_errors=True)
+        # Drop day/month/year folders left empty
+        parent = os.path.dirname(shard)
+        while parent:
+            try:
+                os.rmdir(os.path.join(self.directory, parent))
+            except OSError:
+                break
+            parent = os.path.dirname(parent)
+
+    def collect(self) -> Dict[str, int]:
+        """
+        Delete runs past ``max_age_days`` (whole shards), then the oldest runs
+        until the rest fit in ``max_bytes``. The last two hours are never touched.
+        """
+        now = datetime.now(timezone.utc)
+        # Runs still being written may sit in the previous hour's shard too
+        recent = {f"{now:%Y/%m/%d/%H}", f"{now - timedelta(hours=1):%Y/%m/%d/%H}"}
+        removed_runs = 0
+        removed_bytes = 0
+        all_shards = self._shards()
+        shards = [shard for shard in all_shards if shard.replace(os.sep, "/") not in recent]
+
+        if self.max_age_days is not None:
+            cutoff = now - timedelta(days=self.max_age_days)
+            kept = []
+            for shard in shards:
+                start = datetime.strptime(shard.replace(os.sep, "/"), "%Y/%m/%d/%H").replace(tzinfo=timezone.utc)
+                if start + timedelta(hours=1) <= cutoff:
+                    runs = self._read_index(shard)
+                    removed_runs += len(runs)
+                    removed_bytes += sum(size for _, size in runs)
+                    self._remove_shard(shard)
+                else:
+                    kept.append(shard)
+            shards = kept
+
+        if self.max_bytes is not None:
+            indexes = {shard: self._read_index(shard) for shard in shards}
+            recent_bytes = sum(size for shard in all_shards if shard.replace(os.sep, "/") in recent
+                               for _, size in self._read_index(shard))
+            total = recent_bytes + sum(size for runs in indexes.values() for _, size in runs)
+            for shard in shards:
+                if total <= self.max_bytes:
+                    break
+                runs = indexes[shard]
+                while runs and total > self.max_bytes:
+                    name, size = runs.pop(0)
+                    shutil.rmtree(os.path.join(self.directory, shard, name), ignore_errors=True)
+                    total -= size
+                    removed_runs += 1
+                    removed_bytes += size
+                if runs:
+                    self._write_index(shard, runs)
+                else:
+                    self._remove_shard(shard)
+
+        return {"removed_runs": removed_runs, "removed_bytes": removed_bytes}
@@ -0,0 +1,142 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+from typing import Any, Dict, Optional
+from ..config import *
+from .image_io import SpooledUpload, Upload
+
+# The upload's original bytes, decoded again when it is reprocessed
+SOURCE_NAME = "source"
+
+
+class StageCache:
+    """
+    On-disk store of intermediate pipeline outputs.
+
+    Everything derived from one input lives under ``directory/<content hash>/``:
+    the upload's encoded bytes as ``source`` and each stage output as
+    ``<stage>-<params hash>.json``, where the params hash covers exactly the
+    settings (and upstream results) that stage depends on. A running total of
+    the stored bytes is kept, and once it exceeds ``max_bytes`` whole input
+    directories are evicted least recently used first.
+    """
+
+    def __init__(self, directory: str = STAGE_CACHE_DIR, max_bytes: int = STAGE_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self._bytes: Optional[int] = None  # counted on the first write
+
+    @staticmethod
+    def params_key(params: Dict) -> str:
+        return hashlib.sha256(json.dumps(params, sort_keys=True, default=str).encode()).hexdigest()[:32]
+
+    def _input_dir(self, content_hash: str) -> str:
+        return os.path.join(self.directory, content_hash)
+
+    def _touch(self, content_hash: str):
+        try:
+            os.utime(self._input_dir(content_hash))
+        except OSError:
+            pass
+
+    def _count(self, hit: bool):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def get_source(self, content_hash: str) -> Optional[str]:
+        """Path of the stored upload bytes, or None."""
+        path = os.path.join(self._input_dir(content_hash), SOURCE_NAME)
+        if not os.path.isfile(path):
+            self._count(False)
+            return None
+        self._count(True)
+        self._touch(content_hash)
+        return path
+
+    def put_source(self, content_hash: str, source: Upload):
+        """Keep the upload's encoded bytes (not the decoded page) so it can be reprocessed."""
+        input_dir = self._input_dir(content_hash)
+        path = os.path.join(input_dir, SOURCE_NAME)
+        if os.path.exists(path):
+            self._touch(content_hash)
+            return
+        os.makedirs(input_dir, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        if isinstance(source, bytes):
+            with open(tmp_path, "wb") as f:
+                f.write(source)
+        else:
+            shutil.copyfile(source.path if isinstance(source, SpooledUpload) else source, tmp_path)
+        os.replace(tmp_path, path)
+        self._added(os.path.getsize(path))
+
+    def get(self, content_hash: str, stage: str, params: Dict) -> Optional[Any]:
+        """Return a stage's stored output for these params, or None."""
+        path = os.path.join(self._input_dir(content_hash), f"{stage}-{self.params_key(params)}.json")
+        try:
+            with open(path) as f:
+                value = json.load(f)
+        except (OSError, ValueError):
+            self._count(False)
+            return None
+        self._count(True)
+        self._touch(content_hash)
+        return value
+
+    def put(self, content_hash: str, stage: str, params: Dict, value: Any):
+        input_dir = self._input_dir(content_hash)
+        os.makedirs(input_dir, exist_ok=True)
+        path = os.path.join(input_dir, f"{stage}-{self.params_key(params)}.json")
+        data = json.dumps(value).encode()
+        replaced = os.path.getsize(path) if os.path.exists(path) else 0
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        self._added(len(data) - replaced)
+
+    def _added(self, size: int):
+        """Keep a running total of the store's size and trim it once it exceeds ``max_bytes``."""
+        with self._lock:
+            if self._bytes is None:
+                self._bytes = sum(size for _, _, size in self._inputs())
+            else:
+                self._bytes += size
+            if self._bytes > self.max_bytes:
+                self._evict()
+
+    def _inputs(self):
+        """(last use, path, size) of every input directory."""
+        if not os.path.isdir(self.directory):
+            return []
+        inputs = []
+        for entry in os.scandir(self.directory):
+            if not entry.is_dir():
+                continue
+            size = sum(f.stat().st_size for f in os.scandir(entry.path) if f.is_file())
+            inputs.append((entry.stat().st_mtime, entry.path, size))
+        return inputs
+
+    def _evict(self):
+        """Drop the least recently used inputs until 90% of ``max_bytes`` is left."""
+        inputs = sorted(self._inputs())
+        total = sum(size for _, _, size in inputs)
+        target = self.max_bytes * 0.9
+        for _, path, size in inputs:
+            if total <= target:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+        self._bytes = total
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "disk_bytes": self._bytes}
@@ -0,0 +1,37 @@
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Dict
+
+
+class StageTimer:
+    """
+    Collects wall-clock durations of named stages, in milliseconds.
+
+    While ``tracemalloc`` is tracing, the peak traced memory of each stage
+    (bytes above what was allocated when it started) is kept in ``peaks``.
+    """
+
+    def __init__(self):
+        self.durations: Dict[str, float] = {}
+        self.peaks: Dict[str, int] = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        tracing = tracemalloc.is_tracing()
+        if tracing:
+            baseline = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = (time.perf_counter() - start) * 1000
+            self.durations[name] = self.durations.get(name, 0.0) + elapsed
+            if tracing:
+                peak = tracemalloc.get_traced_memory()[1] - baseline
+                self.peaks[name] = max(self.peaks.get(name, 0), peak)
+
+    @property
+    def total(self) -> float:
+        return sum(self.durations.values())
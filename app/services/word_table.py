@@ -0,0 +1,60 @@
+from typing import Dict, List, Sequence, Tuple
+import numpy as np
+from ..config import *
+
+
+class WordTable:
+    """
+    Columnar (NumPy) view over OCR word dicts for text-to-photo matching.
+
+    Columns hold ``x``, ``y``, ``w``, ``h`` and ``center_x``; row ``i`` refers
+    back to ``words[i]``, so matched words are returned as the original dicts
+    and the JSON written for them does not change.
+    """
+
+    def __init__(self, words: List[Dict]):
+        self.words = words
+        n = len(words)
+        self.x = np.fromiter((word['x'] for word in words), dtype=np.int64, count=n)
+        self.y = np.fromiter((word['y'] for word in words), dtype=np.int64, count=n)
+        self.w = np.fromiter((word['w'] for word in words), dtype=np.int64, count=n)
+        self.h = np.fromiter((word['h'] for word in words), dtype=np.int64, count=n)
+        self.center_x = self.x + self.w / 2
+        self.bottom = self.y + self.h
+
+    def __len__(self) -> int:
+        return len(self.words)
+
+    def match(
+        self,
+        photo_boxes: Sequence[Tuple[int, int, int, int]],
+        search_height: int = TEXT_SEARCH_HEIGHT,
+        width_tolerance: int = TEXT_SEARCH_WIDTH_TOLERANCE,
+    ) -> List[List[Dict]]:
+        """
+        Return, for every box, the words below it sorted left to right.
+
+        All boxes are tested against all words in one broadcast pass. A word
+        matches when it lies fully inside the ``search_height`` strip under the
+        box and its center is within ``width_tolerance`` of the box sides.
+        """
+        if not photo_boxes:
+            return []
+        if not self.words:
+            return [[] for _ in photo_boxes]
+
+        boxes = np.asarray(photo_boxes, dtype=np.int64).reshape(-1, 4)
+        x, y, w, h = (boxes[:, i:i + 1] for i in range(4))
+        photo_bottom = y + h
+
+        is_below = (self.y > photo_bottom) & (self.bottom < photo_bottom + search_height)
+        is_aligned = (self.center_x > x - width_tolerance) & (self.center_x < x + w + width_tolerance)
+        mask = is_below & is_aligned
+
+        matches = []
+        for row in mask:
+            idx = np.flatnonzero(row)
+            # Stable, like list.sort(key=x): words sharing an x keep OCR order
+            idx = idx[np.argsort(self.x[idx], kind='stable')]
+            matches.append([self.words[i] for i in idx])
+        return matches
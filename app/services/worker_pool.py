@@ -0,0 +1,198 @@
+import asyncio
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, Optional
+from ..config import *
+
+
+class PoolBusyError(RuntimeError):
+    """Raised when every worker is busy and the wait queue is full."""
+
+
+class JobTimeoutError(TimeoutError):
+    """Raised when a job does not finish within its time budget."""
+
+
+class JobCancelledError(RuntimeError):
+    """Raised when a job is abandoned before it finishes."""
+
+
+def check_cancelled(cancel_event: Optional[threading.Event]):
+    """Stop a running job between stages once its caller has given up."""
+    if cancel_event is not None and cancel_event.is_set():
+        raise JobCancelledError("Job cancelled")
+
+
+# Each worker process keeps its own service instance.
+_worker_service = None
+
+
+def _init_worker(factory: Callable[[], Any]):
+    global _worker_service
+    _worker_service = factory()
+
+
+def _call_worker_service(method: str, args: tuple, kwargs: dict) -> Any:
+    return getattr(_worker_service, method)(*args, **kwargs)
+
+
+def _worker_startup_timings() -> tuple:
+    return os.getpid(), dict(getattr(_worker_service, "startup_timings", {}))
+
+
+class ProcessingPool:
+    """Runs blocking service calls off the event loop on a bounded pool."""
+
+    def __init__(
+        self,
+        factory: Callable[[], Any],
+        kind: str = WORKER_POOL_KIND,
+        workers: int = WORKER_POOL_SIZE,
+        queue_size: int = WORKER_QUEUE_SIZE,
+        timeout: float = JOB_TIMEOUT_SECONDS,
+    ):
+        if kind not in ("thread", "process"):
+            raise ValueError(f"Unknown worker pool kind: {kind}")
+        self.kind = kind
+        self.workers = workers
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self._factory = factory
+        self._service = None
+        self._executor = None
+        self._lock = threading.Lock()
+        self._pending = 0
+        # Startup phase timings (ms) reported by each worker's service, keyed by pid
+        self.startup_timings: Dict[int, Dict[str, float]] = {}
+
+    @property
+    def capacity(self) -> int:
+        return self.workers + self.queue_size
+
+    @property
+    def pending(self) -> int:
+        """Jobs currently running or waiting for a worker."""
+        return self._pending
+
+    @property
+    def started(self) -> bool:
+        return self._executor is not None
+
+    @property
+    def service(self) -> Any:
+        """The shared service of a thread pool (None for process pools)."""
+        return self._service
+
+    def start(self):
+        """
+        Create the executor and its service(s); blocks until they are ready.
+
+        Process workers are spawned on demand, so one startup probe is sent
+        per worker to make each of them build its service right away.
+        """
+        with self._lock:
+            if self._executor is not None:
+                return
+            if self.kind == "thread":
+                self._service = self._factory()
+                self.startup_timings = {os.getpid(): dict(getattr(self._service, "startup_timings", {}))}
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.workers, thread_name_prefix="processing"
+                )
+            else:
+                executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    initializer=_init_worker,
+                    initargs=(self._factory,),
+                )
+                probes = [executor.submit(_worker_startup_timings) for _ in range(self.workers)]
+                self.startup_timings = dict(probe.result() for probe in probes)
+                self._executor = executor
+
+    def shutdown(self, wait: bool = True):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=wait, cancel_futures=True)
+                self._executor = None
+
+    def _discard_executor(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+    def _job_finished(self, _future):
+        with self._lock:
+            self._pending -= 1
+
+    async def run(self, method: str, *args, request=None, timeout: Optional[float] = None, **kwargs) -> Any:
+        """
+        Call ``method`` on the service in a worker and wait for the result.
+
+        The job is abandoned when it exceeds ``timeout`` or when ``request``
+        (a Starlette request) reports that the client has disconnected.
+        Thread workers are told to stop through a ``cancel_event`` keyword;
+        process workers can only be cancelled while still queued.
+        """
+        if not self.started:
+            await asyncio.get_running_loop().run_in_executor(None, self.start)
+
+        with self._lock:
+            if self._pending >= self.capacity:
+                raise PoolBusyError(f"Processing queue is full ({self.capacity} jobs)")
+            self._pending += 1
+
+        cancel_event = None
+        try:
+            if self.kind == "thread":
+                cancel_event = threading.Event()
+                kwargs["cancel_event"] = cancel_event
+                future = self._executor.submit(getattr(self._service, method), *args, **kwargs)
+            else:
+                future = self._executor.submit(_call_worker_service, method, args, kwargs)
+        except BaseException:
+            self._job_finished(None)
+            raise
+        future.add_done_callback(self._job_finished)
+
+        waiter = asyncio.wrap_future(future)
+        watcher = asyncio.ensure_future(self._watch_disconnect(request)) if request is not None else None
+        waiting_on = [waiter] + ([watcher] if watcher is not None else [])
+        try:
+            done, _ = await asyncio.wait(
+                waiting_on,
+                timeout=self.timeout if timeout is None else timeout,
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+        except asyncio.CancelledError:
+            self._abandon(waiter, cancel_event)
+            raise
+        finally:
+            if watcher is not None:
+                watcher.cancel()
+
+        if waiter in done:
+            try:
+                return waiter.result()
+            except BrokenProcessPool:
+                # A worker died (e.g. killed for memory); replace the whole pool
+                self._discard_executor()
+                asyncio.get_running_loop().run_in_executor(None, self.start)
+                raise
+
+        self._abandon(waiter, cancel_event)
+        if watcher is not None and watcher in done:
+            raise JobCancelledError("Client disconnected")
+        raise JobTimeoutError(f"Job did not finish within {self.timeout if timeout is None else timeout}s")
+
+    def _abandon(self, waiter: asyncio.Future, cancel_event: Optional[threading.Event]):
+        if cancel_event is not None:
+            cancel_event.set()
+        # Cancels the job outright if it has not reached a worker yet.
+        waiter.cancel()
+
+    async def _watch_disconnect(self, request):
+        while not await request.is_disconnected():
+            await asyncio.sleep(DISCONNECT_POLL_INTERVAL)
@@ -0,0 +1,67 @@
+"""
+Compare the contour and connected-components photo detectors.
+
+Runs both detectors over every image in ``templates/`` and reports the
+median time of each and whether they found the same boxes, plus the
+``DETECTION_RESOLUTION = "normalized"`` mode (contours on a downscaled
+page with relative area limits) and how many boxes it found.
+
+    python -m benchmarks.compare_detectors [--repeats 20] [--upscale 2]
+
+``--upscale`` enlarges each page (and the area limits with it) to mimic
+high-DPI scans; the normalized mode needs no such adjustment.
+"""
+import argparse
+import os
+import statistics
+import time
+import cv2
+from app.config import TEMPLATE_DIR
+from app.services import contour_processing
+from app.services.contour_processing import ContourProcessingService
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".tif", ".tiff", ".bmp")
+
+
+def _median_ms(fn, image, repeats):
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        boxes = fn(image)
+        times.append((time.perf_counter() - start) * 1000)
+    return statistics.median(times), boxes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--repeats", type=int, default=20)
+    parser.add_argument("--upscale", type=float, default=1.0)
+    args = parser.parse_args()
+
+    # Area limits are absolute pixels, so scale them with the page
+    contour_processing.MIN_AREA *= args.upscale ** 2
+    contour_processing.MAX_AREA *= args.upscale ** 2
+
+    service = ContourProcessingService()
+    print(f"{'image':40} {'contours ms':>12} {'components ms':>14} {'boxes':>6}  same "
+          f"{'normalized ms':>14} {'boxes':>6}")
+    for name in sorted(os.listdir(TEMPLATE_DIR)):
+        if not name.lower().endswith(IMAGE_EXTENSIONS):
+            continue
+        image = cv2.imread(os.path.join(TEMPLATE_DIR, name), cv2.IMREAD_GRAYSCALE)
+        if image is None:
+            continue
+        if args.upscale != 1.0:
+            image = cv2.resize(image, None, fx=args.upscale, fy=args.upscale, interpolation=cv2.INTER_LINEAR)
+
+        contour_ms, contour_boxes = _median_ms(service.detect_photo_contours, image, args.repeats)
+        component_ms, component_boxes = _median_ms(service.detect_photo_components, image, args.repeats)
+        normalized_ms, normalized_boxes = _median_ms(
+            lambda page: service.detect_photo_boxes(page, {"DETECTION_RESOLUTION": "normalized"}), image, args.repeats)
+        same = "yes" if contour_boxes == component_boxes else "NO"
+        print(f"{name:40} {contour_ms:12.1f} {component_ms:14.1f} {len(contour_boxes):6d}  {same:4} "
+              f"{normalized_ms:14.1f} {len(normalized_boxes):6d}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Compare registered-layout matching with generic photo box detection.
+
+Registers the given templates as layouts in a temporary registry, then for
+every image in ``templates/`` (and a copy shifted by ``--shift`` pixels)
+reports the median time of contour detection and of layout matching, the
+layout matched and its score, and how many detected boxes the matched
+slots reproduce to within ``--tolerance`` pixels.
+
+    python -m benchmarks.compare_layouts [--register "Template Form Foto Portrait.jpg" "Template 1.png"]
+                                         [--repeats 20] [--upscale 2]
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+import cv2
+import numpy as np
+from app.config import TEMPLATE_DIR
+from app.services import contour_processing
+from app.services.contour_processing import ContourProcessingService
+from app.services.layouts import LayoutRegistry
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".tif", ".tiff", ".bmp")
+
+
+def _median_ms(fn, image, repeats):
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        value = fn(image)
+        times.append((time.perf_counter() - start) * 1000)
+    return statistics.median(times), value
+
+
+def _reproduced(slots, boxes, tolerance: int) -> int:
+    return sum(1 for box in boxes
+               if any(max(abs(a - b) for a, b in zip(slot, box)) <= tolerance for slot in slots))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--register", nargs="*", default=["Template Form Foto Portrait.jpg", "Template 1.png"],
+                        help="templates to register as layouts")
+    parser.add_argument("--repeats", type=int, default=20)
+    parser.add_argument("--upscale", type=float, default=1.0)
+    parser.add_argument("--shift", type=int, nargs=2, default=[25, -18], metavar=("DX", "DY"))
+    parser.add_argument("--tolerance", type=int, default=4)
+    args = parser.parse_args()
+
+    contour_processing.MIN_AREA *= args.upscale ** 2
+    contour_processing.MAX_AREA *= args.upscale ** 2
+
+    def read(name):
+        image = cv2.imread(os.path.join(TEMPLATE_DIR, name), cv2.IMREAD_GRAYSCALE)
+        if image is not None and args.upscale != 1.0:
+            image = cv2.resize(image, None, fx=args.upscale, fy=args.upscale, interpolation=cv2.INTER_LINEAR)
+        return image
+
+    service = ContourProcessingService()
+    with tempfile.TemporaryDirectory() as directory:
+        registry = LayoutRegistry(directory)
+        for name in args.register:
+            image = read(name)
+            slots = service.detect_photo_boxes(image)
+            registry.register(os.path.splitext(name)[0].replace(" ", "_")[:64], image, slots,
+                              [service._name_band(slot, image.shape) for slot in slots])
+
+        dx, dy = args.shift
+        print(f"{'image':36} {'shift':>5} {'contours ms':>12} {'boxes':>6} {'layout ms':>10} "
+              f"{'layout':24} {'score':>6} {'same':>5}")
+        for name in sorted(os.listdir(TEMPLATE_DIR)):
+            if not name.lower().endswith(IMAGE_EXTENSIONS):
+                continue
+            image = read(name)
+            if image is None:
+                continue
+            shifted = cv2.warpAffine(image, np.float32([[1, 0, dx], [0, 1, dy]]), image.shape[::-1],
+                                     borderValue=255)
+            for label, page in (("no", image), ("yes", shifted)):
+                detect_ms, boxes = _median_ms(service.detect_photo_boxes, page, args.repeats)
+                match_ms, match = _median_ms(registry.match, page, args.repeats)
+                layout, score, same = "-", "", ""
+                if match is not None:
+                    layout, score = match["name"][:24], f"{match['score']:.3f}"
+                    same = str(_reproduced(match["slots"], boxes, args.tolerance))
+                print(f"{name[:36]:36} {label:>5} {detect_ms:12.1f} {len(boxes):6d} {match_ms:10.1f} "
+                      f"{layout:24} {score:>6} {same:>5}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Compare the OCR backends on the name bands of real and synthetic pages.
+
+Photo boxes and face checks are computed once per page; then each backend
+reads the name bands of the confirmed photos. Reports the median OCR time
+per page, the match rate (photos that got a name) and, for synthetic pages,
+the accuracy against their printed names.
+
+    python -m benchmarks.compare_ocr [--backends easyocr tesseract] [--repeats 3] [--synthetic 8 24]
+
+Backends that cannot load here (e.g. no tesseract binary) are skipped.
+"""
+import argparse
+import os
+import statistics
+import time
+from typing import Dict, List, Optional
+import cv2
+from app.config import TEMPLATE_DIR
+from app.services.contour_processing import ContourProcessingService
+from app.services.ocr_backends import OCR_BACKENDS
+from benchmarks.synthetic import harvest_portraits, make_page
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".tif", ".tiff", ".bmp")
+
+
+def _pages(service: ContourProcessingService, synthetic_counts) -> Dict:
+    """Grayscale pages by name, with ground-truth names for the synthetic ones."""
+    pages = {}
+    for name in sorted(os.listdir(TEMPLATE_DIR)):
+        if name.lower().endswith(IMAGE_EXTENSIONS):
+            image = cv2.imread(os.path.join(TEMPLATE_DIR, name), cv2.IMREAD_GRAYSCALE)
+            if image is not None:
+                pages[name] = (image, None)
+    if synthetic_counts:
+        portraits = harvest_portraits(service)
+        for count in synthetic_counts:
+            page, truth = make_page(portraits, count)
+            pages[f"synthetic_{count}"] = (cv2.cvtColor(page, cv2.COLOR_BGR2GRAY), truth)
+    return pages
+
+
+def _truth_for(box, truth: List[Dict]) -> Optional[str]:
+    """Printed name of the ground-truth photo whose centre lies in ``box``."""
+    x, y, w, h = box
+    for item in truth:
+        b = item["bbox"]
+        cx, cy = b["x"] + b["w"] / 2, b["y"] + b["h"] / 2
+        if x <= cx < x + w and y <= cy < y + h:
+            return item["name"]
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--backends", nargs="*", default=list(OCR_BACKENDS))
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--synthetic", type=int, nargs="*", default=[8, 24],
+                        help="photo counts of the synthetic pages to add")
+    args = parser.parse_args()
+
+    service = ContourProcessingService()
+    service.result_cache = None
+    service.stage_cache = None
+    service.load_models()
+
+    backends = []
+    for backend in args.backends:
+        try:
+            service._ocr(backend)
+            backends.append(backend)
+        except Exception as e:
+            print(f"Skipping {backend}: {e}")
+
+    pages = _pages(service, args.synthetic)
+    print(f"{'page':34} {'photos':>6} " + " ".join(f"{b + ' ms':>14} {'named':>6} {'correct':>7}" for b in backends))
+    try:
+        for name, (gray, truth) in pages.items():
+            boxes = service.detect_photo_boxes(gray)
+            confirmed = [box for box, ok in zip(boxes, service.verify_faces(gray, boxes)) if ok]
+            cells = []
+            for backend in backends:
+                settings = service.effective_settings({"OCR_BACKEND": backend})
+                times = []
+                for _ in range(args.repeats):
+                    start = time.perf_counter()
+                    box_words = service.read_text_for_boxes(gray, confirmed, settings)
+                    times.append((time.perf_counter() - start) * 1000)
+                names = [n for n, _ in service.match_text_to_photos(confirmed, box_words, settings)]
+                named = sum(1 for n in names if n)
+                correct = "-"
+                if truth is not None:
+                    correct = str(sum(1 for box, n in zip(confirmed, names)
+                                      if n and n.lower() == (_truth_for(box, truth) or "").lower()))
+                cells.append(f"{statistics.median(times):14.1f} {named:6d} {correct:>7}")
+            print(f"{name[:34]:34} {len(confirmed):6d} " + " ".join(cells))
+    finally:
+        for backend in service.ocr_backends.values():
+            backend.shutdown()
+
+
+if __name__ == "__main__":
+    main()
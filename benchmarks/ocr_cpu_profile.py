@@ -0,0 +1,130 @@
+"""
+Throughput and accuracy of EasyOCR CPU profiles on the name bands.
+
+For an fp32 and an int8 recognizer, runs every page's name bands (templates
+plus synthetic pages) with W concurrent workers of T torch threads each, as
+a thread pool of W workers with OCR_TORCH_THREADS = T would. Reports bands
+per second and, against the fp32 names, how many names the int8 recognizer
+changed, plus accuracy against the printed names on synthetic pages.
+
+    python -m benchmarks.ocr_cpu_profile [--layouts 1x4 2x2 4x1] [--synthetic 24] [--out profile.json]
+"""
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple
+import cv2
+from app.config import TEMPLATE_DIR
+from app.services.contour_processing import ContourProcessingService
+from app.services.ocr_backends import EasyOcrBackend, configure_torch_threads
+from app.services.timing import StageTimer
+from benchmarks.compare_ocr import _truth_for
+from benchmarks.synthetic import harvest_portraits, make_page
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".tif", ".tiff", ".bmp")
+
+
+def _default_layouts() -> List[str]:
+    cores = os.cpu_count() or 1
+    layouts = []
+    workers = 1
+    while workers <= cores:
+        layouts.append(f"{workers}x{cores // workers}")
+        workers *= 2
+    return layouts
+
+
+def _pages(service: ContourProcessingService, synthetic_counts) -> List[Dict]:
+    """Confirmed photo boxes and name bands of every page (computed once)."""
+    images = []
+    for name in sorted(os.listdir(TEMPLATE_DIR)):
+        if name.lower().endswith(IMAGE_EXTENSIONS):
+            image = cv2.imread(os.path.join(TEMPLATE_DIR, name), cv2.IMREAD_GRAYSCALE)
+            if image is not None:
+                images.append((name, image, None))
+    if synthetic_counts:
+        portraits = harvest_portraits(service)
+        for count in synthetic_counts:
+            page, truth = make_page(portraits, count)
+            images.append((f"synthetic_{count}", cv2.cvtColor(page, cv2.COLOR_BGR2GRAY), truth))
+
+    settings = service.effective_settings()
+    pages = []
+    for name, gray, truth in images:
+        boxes = service.detect_photo_boxes(gray, settings)
+        boxes = [box for box, ok in zip(boxes, service.verify_faces(gray, boxes, settings)) if ok]
+        if boxes:
+            bands = [service._name_band(box, gray.shape, settings) for box in boxes]
+            pages.append({"name": name, "gray": gray, "boxes": boxes, "bands": bands, "truth": truth})
+    return pages
+
+
+def _run(service: ContourProcessingService, backend: EasyOcrBackend, pages: List[Dict],
+         workers: int) -> Tuple[float, List[List]]:
+    settings = service.effective_settings()
+
+    def read(page):
+        words = backend.read_bands(page["gray"], page["bands"], settings)
+        return [name for name, _ in service.match_text_to_photos(page["boxes"], words, settings)]
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        names = list(pool.map(read, pages))
+    return time.perf_counter() - start, names
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--layouts", nargs="*", default=_default_layouts(),
+                        help="WORKERSxTHREADS, e.g. 2x4")
+    parser.add_argument("--synthetic", type=int, nargs="*", default=[24])
+    parser.add_argument("--out", help="write the results as JSON here")
+    args = parser.parse_args()
+
+    configure_torch_threads(interop_threads=1)
+    service = ContourProcessingService()
+    service.result_cache = None
+    service.stage_cache = None
+    service.load_models()
+    pages = _pages(service, args.synthetic)
+    bands = sum(len(page["bands"]) for page in pages)
+    print(f"{len(pages)} pages, {bands} name bands")
+
+    report = {"cpu_count": os.cpu_count(), "bands": bands, "runs": []}
+    reference = None
+    print(f"{'recognizer':10} {'layout':>7} {'seconds':>8} {'bands/s':>8} {'changed':>8} {'correct':>8}")
+    # fp32 first: its names are the reference for the int8 recognizer
+    for quantize in (False, True):
+        backend = EasyOcrBackend(quantize=quantize)
+        backend.load(StageTimer())
+        # One untimed pass so lazy allocations do not count against the first layout
+        _run(service, backend, pages[:1], 1)
+        for layout in args.layouts:
+            workers, threads = (int(v) for v in layout.lower().split("x"))
+            configure_torch_threads(threads, None)
+            seconds, names = _run(service, backend, pages, workers)
+            flat = [name for page_names in names for name in page_names]
+            if reference is None:
+                reference = flat
+            changed = sum(1 for a, b in zip(flat, reference) if a != b)
+            correct = sum(
+                1 for page, page_names in zip(pages, names) if page["truth"]
+                for box, name in zip(page["boxes"], page_names)
+                if name and name.lower() == (_truth_for(box, page["truth"]) or "").lower()
+            )
+            recognizer = "int8" if quantize else "fp32"
+            report["runs"].append({"recognizer": recognizer, "workers": workers, "threads": threads,
+                                   "seconds": round(seconds, 3), "bands_per_second": round(bands / seconds, 2),
+                                   "changed_vs_fp32": changed, "synthetic_correct": correct})
+            print(f"{recognizer:10} {layout:>7} {seconds:8.2f} {bands / seconds:8.1f} {changed:8d} {correct:8d}")
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+"""
+Per-stage benchmark of the full processing pipeline.
+
+Runs ``process_image`` (caches off, output to a temp folder) over every
+image in ``templates/`` and over synthetic pages, and reports p50/p95 wall
+time per stage (decode, boxes, faces, ocr, match, output) plus the peak
+traced memory of each stage from one extra run under ``tracemalloc``.
+
+    python -m benchmarks.pipeline [--repeats 5] [--synthetic 8 24 48] [--out bench.json]
+    python -m benchmarks.pipeline --out new.json --compare baseline.json [--max-regression 0.2]
+
+With ``--compare`` the exit status is 1 when any stage's p50 got slower than
+the baseline by more than ``--max-regression`` (and by at least 1 ms).
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Dict, List
+import cv2
+from app.config import TEMPLATE_DIR, BASE_DIR
+from app.services.contour_processing import ContourProcessingService
+from app.services.run_store import RunStore
+from benchmarks.synthetic import harvest_portraits, make_page
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".tif", ".tiff", ".bmp")
+STAGES = ("decode", "boxes", "faces", "ocr", "match", "output")
+
+
+def _percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    if len(ordered) == 1:
+        return ordered[0]
+    position = (len(ordered) - 1) * q
+    low = int(position)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (position - low)
+
+
+def _inputs(portraits, synthetic_counts) -> Dict[str, bytes]:
+    """Encoded page bytes by name, so the decode stage is part of the measurement."""
+    inputs = {}
+    for name in sorted(os.listdir(TEMPLATE_DIR)):
+        if name.lower().endswith(IMAGE_EXTENSIONS):
+            with open(os.path.join(TEMPLATE_DIR, name), "rb") as f:
+                inputs[name] = f.read()
+    for count in synthetic_counts:
+        page, _ = make_page(portraits, count)
+        inputs[f"synthetic_{count}"] = cv2.imencode(".png", page)[1].tobytes()
+    return inputs
+
+
+def _measure(service: ContourProcessingService, data: bytes, repeats: int) -> Dict:
+    samples = {stage: [] for stage in STAGES + ("total",)}
+    photos = 0
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = service.process_image(data, "benchmark")
+        samples["total"].append((time.perf_counter() - start) * 1000)
+        for stage in STAGES:
+            samples[stage].append(result["timings"].get(stage, 0.0))
+        photos = result["total_processed"]
+
+    tracemalloc.start()
+    try:
+        peaks = service.process_image(data, "benchmark").get("memory_peaks", {})
+    finally:
+        tracemalloc.stop()
+
+    stages = {}
+    for stage, values in samples.items():
+        stages[stage] = {
+            "p50_ms": round(_percentile(values, 0.5), 2),
+            "p95_ms": round(_percentile(values, 0.95), 2),
+            "mean_ms": round(statistics.mean(values), 2),
+        }
+        if stage in peaks:
+            stages[stage]["peak_bytes"] = peaks[stage]
+    return {"photos": photos, "repeats": repeats, "stages": stages}
+
+
+def _metadata(args) -> Dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BASE_DIR,
+                                capture_output=True, text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "opencv": cv2.__version__,
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "repeats": args.repeats,
+        "settings": ContourProcessingService.effective_settings(),
+    }
+
+
+def _compare(current: Dict, baseline: Dict, max_regression: float) -> List[str]:
+    """Stages whose p50 got slower than ``max_regression`` allows."""
+    regressions = []
+    for name, entry in current["inputs"].items():
+        before = baseline.get("inputs", {}).get(name)
+        if before is None:
+            continue
+        for stage, stats in entry["stages"].items():
+            old = before["stages"].get(stage, {}).get("p50_ms")
+            new = stats["p50_ms"]
+            if old is None:
+                continue
+            if new - old >= 1.0 and new > old * (1 + max_regression):
+                regressions.append(f"{name} {stage}: {old:.1f} -> {new:.1f} ms p50")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--synthetic", type=int, nargs="*", default=[8, 24, 48],
+                        help="photo counts of the synthetic pages to add")
+    parser.add_argument("--out", help="write the results as JSON here")
+    parser.add_argument("--compare", help="baseline JSON from an earlier run")
+    parser.add_argument("--max-regression", type=float, default=0.2)
+    args = parser.parse_args()
+
+    service = ContourProcessingService()
+    # Measure the pipeline, not the caches
+    service.result_cache = None
+    service.stage_cache = None
+    output_dir = tempfile.mkdtemp(prefix="benchmark_")
+    service.run_store = RunStore(output_dir)
+    service.load_models()
+    service.warm_up()
+
+    report = {"meta": _metadata(args), "inputs": {}}
+    try:
+        inputs = _inputs(harvest_portraits(service), args.synthetic)
+        print(f"{'input':34} {'photos':>6} " + " ".join(f"{stage + ' p50/p95':>16}" for stage in STAGES + ("total",)))
+        for name, data in inputs.items():
+            entry = _measure(service, data, args.repeats)
+            report["inputs"][name] = entry
+            cells = " ".join(
+                f"{entry['stages'][stage]['p50_ms']:>7.1f}/{entry['stages'][stage]['p95_ms']:<8.1f}"
+                for stage in STAGES + ("total",)
+            )
+            print(f"{name[:34]:34} {entry['photos']:>6} {cells}")
+    finally:
+        service.crop_writer.shutdown()
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+    # tracemalloc sees Python and NumPy allocations only; OpenCV's show up here
+    report["meta"]["max_rss_kb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote {args.out}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = _compare(report, json.load(f), args.max_regression)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            sys.exit(1)
+        print("No regressions against the baseline")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+Synthetic roster pages for benchmarking.
+
+Portraits are harvested once from the images in ``templates/`` (boxes that
+pass the face check), then tiled on a blank page with a printed name under
+each, laid out so the default area, aspect and text-search settings apply.
+
+    python -m benchmarks.synthetic --photos 24 --out /tmp/page.png
+"""
+import argparse
+import os
+import random
+from typing import Dict, List, Tuple
+import cv2
+import numpy as np
+from app.config import TEMPLATE_DIR
+from app.services.contour_processing import ContourProcessingService
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".tif", ".tiff", ".bmp")
+FIRST_NAMES = ["Andi", "Bagus", "Citra", "Dewi", "Eko", "Fajar", "Gita", "Hadi", "Indah", "Joko",
+               "Kartika", "Lestari", "Made", "Nur", "Putri", "Rizki", "Sari", "Teguh", "Wulan", "Yusuf"]
+LAST_NAMES = ["Pratama", "Saputra", "Wijaya", "Hidayat", "Santoso", "Nugroho", "Rahman", "Kusuma",
+              "Setiawan", "Permata", "Halim", "Utami"]
+
+# Layout: portraits are scaled to this size (inside the default area and aspect limits)
+PHOTO_WIDTH = 180
+PHOTO_HEIGHT = 240
+GAP_X = 70
+CAPTION_OFFSET = 34  # baseline below the photo, inside TEXT_SEARCH_HEIGHT
+ROW_HEIGHT = PHOTO_HEIGHT + 110
+MARGIN = 80
+
+
+def harvest_portraits(service: ContourProcessingService, template_dir: str = TEMPLATE_DIR) -> List[np.ndarray]:
+    """Face-confirmed photo crops from every template image (``service`` must be loaded)."""
+    portraits = []
+    for name in sorted(os.listdir(template_dir)):
+        if not name.lower().endswith(IMAGE_EXTENSIONS):
+            continue
+        image = cv2.imread(os.path.join(template_dir, name))
+        if image is None:
+            continue
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        boxes = service.detect_photo_boxes(gray)
+        for (x, y, w, h), ok in zip(boxes, service.verify_faces(gray, boxes)):
+            if ok:
+                portraits.append(image[y:y + h, x:x + w].copy())
+    if not portraits:
+        raise RuntimeError(f"No face-confirmed photos found in {template_dir}")
+    return portraits
+
+
+def make_page(portraits: List[np.ndarray], photos: int, columns: int = 4,
+              seed: int = 0) -> Tuple[np.ndarray, List[Dict]]:
+    """
+    Tile ``photos`` portraits with name captions; returns the BGR page and
+    the ground truth (name and bbox per photo) in reading order.
+    """
+    rng = random.Random(seed)
+    rows = (photos + columns - 1) // columns
+    width = 2 * MARGIN + columns * PHOTO_WIDTH + (columns - 1) * GAP_X
+    height = 2 * MARGIN + rows * ROW_HEIGHT
+    page = np.full((height, width, 3), 255, dtype=np.uint8)
+
+    truth = []
+    for i in range(photos):
+        row, col = divmod(i, columns)
+        x = MARGIN + col * (PHOTO_WIDTH + GAP_X)
+        y = MARGIN + row * ROW_HEIGHT
+        portrait = cv2.resize(rng.choice(portraits), (PHOTO_WIDTH, PHOTO_HEIGHT), interpolation=cv2.INTER_AREA)
+        page[y:y + PHOTO_HEIGHT, x:x + PHOTO_WIDTH] = portrait
+
+        name = f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}"
+        (text_w, _), _ = cv2.getTextSize(name, cv2.FONT_HERSHEY_SIMPLEX, 0.7, 2)
+        text_x = x + max(0, (PHOTO_WIDTH - text_w) // 2)
+        cv2.putText(page, name, (text_x, y + PHOTO_HEIGHT + CAPTION_OFFSET),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 0), 2, cv2.LINE_AA)
+        truth.append({"name": name, "bbox": {"x": x, "y": y, "w": PHOTO_WIDTH, "h": PHOTO_HEIGHT}})
+    return page, truth
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--photos", type=int, default=24)
+    parser.add_argument("--columns", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", required=True)
+    args = parser.parse_args()
+
+    service = ContourProcessingService()
+    service.load_models()
+    page, truth = make_page(harvest_portraits(service), args.photos, args.columns, args.seed)
+    cv2.imwrite(args.out, page)
+    print(f"Wrote {args.out} ({page.shape[1]}x{page.shape[0]}, {len(truth)} photos)")
+
+
+if __name__ == "__main__":
+    main()